@@ -1,22 +1,47 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, g, Response, has_request_context, abort, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, FloatField, TextAreaField, IntegerField, SelectField
-from wtforms.validators import DataRequired, Length, EqualTo, NumberRange, ValidationError
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from wtforms import Form, StringField, PasswordField, SubmitField, FloatField, TextAreaField, IntegerField, SelectField, HiddenField, FieldList, FormField
+from wtforms.validators import DataRequired, Length, EqualTo, NumberRange, ValidationError, Optional
+from werkzeug.security import generate_password_hash
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as SQLAlchemySession, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from datetime import datetime, timedelta
 from flask_caching import Cache
 from redis import Redis
+from redis.exceptions import RedisError
+import click
+import csv
+import heapq
+import io
+import itertools
 import json
+import os
 import threading
+import uuid
 from functools import wraps
 import time
 import logging
 from logging.handlers import RotatingFileHandler
 from enum import Enum
 import re
+import sqlite3
+from collections import defaultdict, namedtuple
 from decimal import Decimal
+from group_commit import GroupCommitQueue, QueueFullError
+from cache_tiers import CircuitBreaker, CircuitOpenError, GuardedRedis, VersionedCache
+from metrics import MetricsRegistry
+from search_index import SearchIndex
+from credentials import CredentialHasher, LoginBusyError
+from order_events import OrderEventBus, EventBusFullError
+from kitchen_board import KitchenBoard
+from order_shards import OrderShards, ShardRoutingSession
+from rate_limit import Limit, RateLimitExceeded, TokenBucketLimiter
 
 # 配置日志系统
 logging.basicConfig(
@@ -76,67 +101,327 @@ def validate_phone(form, field):
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'  # 用于session加密
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ordersystem.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///ordersystem.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# 添加缓存配置
-app.config['CACHE_TYPE'] = 'redis'
-app.config['CACHE_REDIS_URL'] = 'redis://localhost:6379/0'
+# 存储配置：SQLite 通过连接时执行的 PRAGMA 调优，PostgreSQL 调整连接池大小。
+# SQLITE_PROFILE=default 保持 SQLite 默认设置；单项可用同名环境变量覆盖，设为空字符串表示不设置
+SQLITE_PROFILES = {
+    'default': {},
+    # WAL 下读写互不阻塞；synchronous=NORMAL 在 WAL 下只在检查点时同步磁盘；
+    # busy_timeout 让并发写入排队等待而不是立即报 database is locked
+    'tuned': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': '5000',
+        'mmap_size': str(256 * 1024 * 1024),
+        'cache_size': str(-64 * 1024),  # 负数单位为 KiB，即 64MB
+        'temp_store': 'MEMORY',
+    },
+}
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'tuned')
+app.config['SQLITE_PRAGMAS'] = {
+    name: os.environ.get(f'SQLITE_{name.upper()}', value)
+    for name, value in SQLITE_PROFILES[app.config['SQLITE_PROFILE']].items()
+}
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', '5')),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': True,
+    }
+
+# Redis 连接：REDIS_URL 为空时不使用 Redis，缓存只在进程内（开发和测试环境）
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+app.config['REDIS_SOCKET_TIMEOUT'] = float(os.environ.get('REDIS_SOCKET_TIMEOUT', '0.1'))
+app.config['REDIS_BREAKER_THRESHOLD'] = int(os.environ.get('REDIS_BREAKER_THRESHOLD', '3'))
+app.config['REDIS_BREAKER_RESET'] = float(os.environ.get('REDIS_BREAKER_RESET', '10'))
+# Stream 消费需要阻塞读取，使用不带读超时的独立连接
+redis_client = Redis.from_url(app.config['REDIS_URL']) if app.config['REDIS_URL'] else None
+
+# 缓存使用的 Redis 连接设置了较短的超时并经过断路器，Redis 变慢或宕机时退化为进程内缓存
+redis_breaker = CircuitBreaker(
+    'redis',
+    failure_threshold=app.config['REDIS_BREAKER_THRESHOLD'],
+    reset_timeout=app.config['REDIS_BREAKER_RESET'],
+    slow_call=app.config['REDIS_SOCKET_TIMEOUT']
+)
+cache_redis = GuardedRedis(
+    Redis.from_url(
+        app.config['REDIS_URL'],
+        socket_timeout=app.config['REDIS_SOCKET_TIMEOUT'],
+        socket_connect_timeout=app.config['REDIS_SOCKET_TIMEOUT']
+    ) if app.config['REDIS_URL'] else None,
+    redis_breaker
+)
+
+# 添加缓存配置：进程内 LRU（L1）+ Redis（L2）
+app.config['CACHE_TYPE'] = 'cache_tiers.TieredCache'
+app.config['CACHE_REDIS_HOST'] = cache_redis if app.config['REDIS_URL'] else None
+app.config['CACHE_L1_MAXSIZE'] = int(os.environ.get('CACHE_L1_MAXSIZE', '1024'))
+app.config['CACHE_L1_TTL'] = int(os.environ.get('CACHE_L1_TTL', '30'))
 cache = Cache(app)
-redis_client = Redis(host='localhost', port=6379, db=0)
-
-# 批量处理队列
-order_queue = []
-BATCH_SIZE = 10
-queue_lock = threading.Lock()
-
-def process_order_batch():
-    """批量处理订单"""
-    global order_queue
-    with queue_lock:
-        if len(order_queue) >= BATCH_SIZE:
-            batch = order_queue[:BATCH_SIZE]
-            order_queue = order_queue[BATCH_SIZE:]
-            
-            # 批量插入订单
-            with app.app_context():
-                try:
-                    db.session.bulk_save_objects(batch)
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    # 处理失败的订单重新加入队列
-                    order_queue.extend(batch)
-                    print(f"Error processing batch: {str(e)}")
+
+# 口令哈希在有界进程池中计算，登录和注册的并发数单独限制，避免登录高峰占满请求线程
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+app.config['LOGIN_MAX_CONCURRENCY'] = int(os.environ.get('LOGIN_MAX_CONCURRENCY', '4'))
+app.config['LOGIN_QUEUE_TIMEOUT'] = float(os.environ.get('LOGIN_QUEUE_TIMEOUT', '2'))
+password_hasher = CredentialHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    max_workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_concurrent=app.config['LOGIN_MAX_CONCURRENCY'],
+    acquire_timeout=app.config['LOGIN_QUEUE_TIMEOUT']
+)
+
+# 准入控制：下单和登录先经过令牌桶限流，超出限额时直接返回 429，不进入表单校验和批处理队列。
+# *_RATE 为每秒补充的令牌数（0 表示不限制该项），*_BURST 为允许的突发请求数
+app.config['ORDER_RATE_PER_USER'] = float(os.environ.get('ORDER_RATE_PER_USER', '0.5'))
+app.config['ORDER_BURST_PER_USER'] = int(os.environ.get('ORDER_BURST_PER_USER', '5'))
+app.config['ORDER_RATE_GLOBAL'] = float(os.environ.get('ORDER_RATE_GLOBAL', '200'))
+app.config['ORDER_BURST_GLOBAL'] = int(os.environ.get('ORDER_BURST_GLOBAL', '400'))
+app.config['LOGIN_RATE_PER_CLIENT'] = float(os.environ.get('LOGIN_RATE_PER_CLIENT', '0.2'))
+app.config['LOGIN_BURST_PER_CLIENT'] = int(os.environ.get('LOGIN_BURST_PER_CLIENT', '10'))
+app.config['LOGIN_RATE_GLOBAL'] = float(os.environ.get('LOGIN_RATE_GLOBAL', '20'))
+app.config['LOGIN_BURST_GLOBAL'] = int(os.environ.get('LOGIN_BURST_GLOBAL', '50'))
+RATE_LIMITS = {
+    'order_user': Limit('order_user', app.config['ORDER_RATE_PER_USER'], app.config['ORDER_BURST_PER_USER']),
+    'order_global': Limit('order_global', app.config['ORDER_RATE_GLOBAL'], app.config['ORDER_BURST_GLOBAL']),
+    'login_client': Limit('login_client', app.config['LOGIN_RATE_PER_CLIENT'], app.config['LOGIN_BURST_PER_CLIENT']),
+    'login_global': Limit('login_global', app.config['LOGIN_RATE_GLOBAL'], app.config['LOGIN_BURST_GLOBAL']),
+}
+rate_limiter = TokenBucketLimiter(cache_redis if redis_client is not None else None)
+
+# 订单事件推送：写入方提交后发布到 Redis 频道，各 Web 进程订阅后按餐厅推送给 SSE 连接。
+# 每个连接在打开期间占用一个请求线程，只向管理员的订单页和后厨看板开放；
+# ORDER_EVENTS_MAX_SUBSCRIBERS 必须明显小于每个进程的工作线程数（gthread 的 --threads），
+# 否则推送连接会占满线程、阻塞下单
+app.config['ORDER_EVENTS_MAX_SUBSCRIBERS'] = int(os.environ.get('ORDER_EVENTS_MAX_SUBSCRIBERS', '8'))
+app.config['ORDER_EVENTS_QUEUE_SIZE'] = int(os.environ.get('ORDER_EVENTS_QUEUE_SIZE', '100'))
+app.config['ORDER_EVENTS_HEARTBEAT'] = float(os.environ.get('ORDER_EVENTS_HEARTBEAT', '15'))
+order_events = OrderEventBus(
+    publisher=cache_redis if redis_client is not None else None,
+    subscriber=redis_client,
+    queue_size=app.config['ORDER_EVENTS_QUEUE_SIZE'],
+    max_subscribers=app.config['ORDER_EVENTS_MAX_SUBSCRIBERS']
+)
+
+# 后厨看板：各餐厅待处理/准备中的订单保存在 Redis 有序集合中，随订单事件在提交后更新
+app.config['KITCHEN_BOARD_LIMIT'] = int(os.environ.get('KITCHEN_BOARD_LIMIT', '100'))
+app.config['KITCHEN_TOMBSTONE_TTL'] = int(os.environ.get('KITCHEN_TOMBSTONE_TTL', '3600'))
+kitchen_board = KitchenBoard(
+    cache_redis if redis_client is not None else None,
+    tombstone_ttl=app.config['KITCHEN_TOMBSTONE_TTL']
+)
+
+# 订单写入方式：'queue' 为进程内批处理队列（开发环境），
+# 'stream' 为 Redis Streams，由独立的 order_writer.py 进程消费落库
+app.config['ORDER_INGEST_MODE'] = os.environ.get('ORDER_INGEST_MODE', 'queue')
+ORDER_STREAM_KEY = 'orders:stream'
+ORDER_STREAM_GROUP = 'order-writers'
+ORDER_DEAD_LETTER_KEY = 'orders:stream:dead'
+if app.config['ORDER_INGEST_MODE'] == 'stream' and redis_client is None:
+    raise RuntimeError('ORDER_INGEST_MODE=stream 需要配置 REDIS_URL')
+
+# 冷订单归档：已完成/已取消且早于 ORDER_ARCHIVE_DAYS 天的订单由 archiver.py 移入归档表，
+# 订单列表和导出只在查询范围早于该分界时才读取归档表；0 表示不归档
+app.config['ORDER_ARCHIVE_DAYS'] = int(os.environ.get('ORDER_ARCHIVE_DAYS', '0'))
+
+# 订单分片：ORDER_SHARD_URLS 为逗号分隔的数据库 URL，餐厅 r 的订单写入第 r % N 个分片，
+# 用户、餐厅和菜品仍在主库；为空时不分片。分片数确定后不能修改
+ORDER_SHARD_TABLES = ('order', 'order_detail', 'order_archive', 'order_detail_archive', 'order_id_sequence',
+                      'restaurant_daily_sales', 'order_status_count', 'dish_sales')
+app.config['ORDER_SHARD_URLS'] = [url.strip() for url in os.environ.get('ORDER_SHARD_URLS', '').split(',')
+                                  if url.strip()]
+order_shards = OrderShards(len(app.config['ORDER_SHARD_URLS']), tables=ORDER_SHARD_TABLES)
+app.config['SQLALCHEMY_BINDS'] = dict(zip(order_shards.bind_keys, app.config['ORDER_SHARD_URLS']))
+
+# 批量处理队列（组提交）：凑满自适应批大小或最早订单等待超过
+# ORDER_BATCH_MAX_LATENCY 秒即提交，队列过深时对下单请求施加背压
+app.config['ORDER_BATCH_MAX_LATENCY'] = float(os.environ.get('ORDER_BATCH_MAX_LATENCY', '0.2'))
+app.config['ORDER_BATCH_MAX_SIZE'] = int(os.environ.get('ORDER_BATCH_MAX_SIZE', '500'))
+app.config['ORDER_QUEUE_MAX_DEPTH'] = int(os.environ.get('ORDER_QUEUE_MAX_DEPTH', '5000'))
+BATCH_SIZE = 10  # 初始批大小
+
+def process_order_batch(batch):
+    """批量处理订单，失败时由队列逐条重试"""
+    with app.app_context():
+        try:
+            save_order_payloads(batch)
+        except Exception:
+            db.session.rollback()
+            raise
+
+def dead_letter_order(payload, error):
+    """多次提交仍失败的订单写入与 order_writer.py 相同的死信 Stream，Redis 不可用时完整记入日志"""
+    body = json.dumps(payload, ensure_ascii=False)
+    if redis_client is not None:
+        try:
+            redis_client.xadd(ORDER_DEAD_LETTER_KEY, {'payload': body, 'reason': str(error),
+                                                      'source_id': 'queue'})
+            return
+        except RedisError as e:
+            logging.error(f"写入死信队列失败: {e}")
+    logging.error(f"订单提交失败已丢弃: {error}; 订单: {body}")
+
+order_queue = GroupCommitQueue(
+    process_order_batch,
+    initial_batch=BATCH_SIZE,
+    max_batch=app.config['ORDER_BATCH_MAX_SIZE'],
+    max_latency=app.config['ORDER_BATCH_MAX_LATENCY'],
+    max_depth=app.config['ORDER_QUEUE_MAX_DEPTH'],
+    dead_letter=dead_letter_order
+)
+
+def enqueue_order(payload):
+    """将序列化后的订单交给写入通道"""
+    if app.config['ORDER_INGEST_MODE'] == 'stream':
+        # 写入 Redis Stream 后即返回，由 order_writer.py 进程确认落库
+        redis_client.xadd(ORDER_STREAM_KEY, {'payload': json.dumps(payload, ensure_ascii=False)})
+        return
+    
+    order_queue.put(payload)
 
 # 启动后台处理线程
 def start_background_processing():
-    def background_worker():
-        while True:
-            process_order_batch()
-            time.sleep(1)  # 每秒检查一次队列
-    
-    thread = threading.Thread(target=background_worker, daemon=True)
-    thread.start()
+    order_queue.start()
+
+# 标签缓存：缓存键中带上各标签的版本号，递增标签版本即可批量淘汰相关条目。
+# Redis 不可用时在本地递增，键中同时带上两部分版本号，Redis 恢复后本地失效依然有效
+local_tag_versions = defaultdict(int)
+
+def tagged_cache_key(base, tags):
+    try:
+        versions = [v.decode() if v else '0' for v in cache_redis.mget(tags)]
+    except CircuitOpenError:
+        versions = ['0'] * len(tags)
+    except RedisError as e:
+        logging.warning(f"读取缓存标签失败，使用本地版本号: {e}")
+        versions = ['0'] * len(tags)
+    return base + ':' + ':'.join(f'{v}.{local_tag_versions[tag]}' for tag, v in zip(tags, versions))
+
+def invalidate_tags(tags):
+    try:
+        pipe = cache_redis.pipeline(transaction=False)
+        for tag in set(tags):
+            pipe.incr(tag)
+        pipe.execute()
+    except RedisError as e:
+        if not isinstance(e, CircuitOpenError):
+            logging.error(f"递增缓存标签失败，只在本进程失效: {e}")
+        for tag in set(tags):
+            local_tag_versions[tag] += 1
+
+db = SQLAlchemy(app, session_options={'class_': ShardRoutingSession, 'shards': order_shards})
+login_manager = LoginManager(app)
+login_manager.login_view = 'login'
+
+# 运行指标：请求路径上只累加计数，/metrics 被抓取时才格式化
+metrics = MetricsRegistry()
+REQUEST_LATENCY = metrics.histogram(
+    'http_request_duration_seconds', '按路由统计的请求耗时', ['endpoint', 'method', 'status'])
+REQUEST_SQL_STATEMENTS = metrics.histogram(
+    'http_request_sql_statements', '每个请求执行的 SQL 条数', ['endpoint'],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+REQUEST_SQL_SECONDS = metrics.histogram(
+    'http_request_sql_seconds', '每个请求的 SQL 总耗时', ['endpoint'])
+SQL_STATEMENTS = metrics.counter('sql_statements_total', '执行的 SQL 总条数（含后台线程）')
+CACHE_REQUESTS = metrics.counter('cache_requests_total', '缓存命中与未命中次数', ['cache', 'result'])
+metrics.gauge('order_queue_depth', '批处理队列中待提交的订单数', lambda: len(order_queue))
+metrics.gauge('order_queue_batch_size', '批处理队列当前的自适应批大小', lambda: order_queue.batch_size)
+metrics.gauge('order_queue_last_flush_seconds', '最近一次批量提交耗时', lambda: order_queue.last_flush_seconds)
+metrics.gauge('order_queue_flushed_orders', '批处理队列累计提交的订单数', lambda: order_queue.flushed_items)
+metrics.gauge('order_queue_rejected_orders', '因队列已满被拒绝的订单数', lambda: order_queue.rejected)
+metrics.gauge('order_queue_dead_lettered_orders', '多次提交失败后移入死信的订单数', lambda: order_queue.dead_lettered)
+metrics.gauge('login_hashes_in_flight', '正在进行的口令哈希计算数', lambda: password_hasher.in_flight)
+metrics.gauge('login_rejected_busy', '因登录并发已满被拒绝的请求数', lambda: password_hasher.rejected)
+metrics.gauge('login_password_rehashed', '登录时按新参数重新哈希的口令数', lambda: password_hasher.rehashed)
+metrics.gauge('redis_circuit_open', 'Redis 断路器是否打开（1 为只使用进程内缓存）',
+              lambda: int(redis_breaker.state != CircuitBreaker.CLOSED or cache_redis.client is None))
+metrics.gauge('order_event_subscribers', '本进程当前的订单事件推送连接数', lambda: order_events.subscriber_count)
+metrics.gauge('order_events_published', '本进程累计发布的订单事件数', lambda: order_events.published)
+metrics.gauge('order_event_dropped_subscribers', '因消费过慢被断开的推送连接数', lambda: order_events.dropped)
+metrics.gauge('kitchen_board_sync_errors', '后厨看板同步失败次数（失败后看板滞后至下次重建）',
+              lambda: kitchen_board.errors)
+metrics.gauge('rate_limit_tokens_per_second', '各限额每秒补充的令牌数（0 为不限制）',
+              lambda: {(name,): limit.rate for name, limit in RATE_LIMITS.items()}, ['limit'])
+metrics.gauge('rate_limit_burst', '各限额允许的突发请求数',
+              lambda: {(name,): limit.burst for name, limit in RATE_LIMITS.items()}, ['limit'])
+metrics.gauge('rate_limited_requests', '本进程因超出限额返回 429 的请求数',
+              lambda: {(name,): rate_limiter.rejected[name] for name in RATE_LIMITS}, ['limit'])
+metrics.gauge('rate_limiter_local_fallbacks', 'Redis 不可用时改用进程内令牌桶的次数',
+              lambda: rate_limiter.fallbacks)
+metrics.gauge('redis_circuit_rejected_calls', '断路器打开期间被拒绝的 Redis 调用数', lambda: redis_breaker.rejected)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' in g:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - g.request_started,
+                                endpoint=endpoint, method=request.method, status=response.status_code)
+        REQUEST_SQL_STATEMENTS.observe(g.sql_statements, endpoint=endpoint)
+        REQUEST_SQL_SECONDS.observe(g.sql_seconds, endpoint=endpoint)
+    return response
 
-# 缓存装饰器
-def cache_order(timeout=300):
+# 准入控制：只对 POST 请求限流，超出限额时直接返回 429，不进入视图函数
+def admission_control(buckets):
+    """buckets() 在请求内调用，返回 [(Limit, 桶键), ...]"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            cache_key = f"order_{request.view_args.get('id', '')}"
-            rv = cache.get(cache_key)
-            if rv is not None:
-                return rv
-            rv = f(*args, **kwargs)
-            cache.set(cache_key, rv, timeout=timeout)
-            return rv
+            if request.method == 'POST':
+                try:
+                    rate_limiter.acquire(buckets())
+                except RateLimitExceeded as e:
+                    logging.info(f"{request.endpoint} 请求被限流: {str(e)}")
+                    return Response('请求过于频繁，请稍后再试', status=429, mimetype='text/plain',
+                                    headers={'Retry-After': rate_limiter.retry_after_header(e.retry_after)})
+            return f(*args, **kwargs)
         return decorated_function
     return decorator
 
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+def order_admission_buckets():
+    """下单（单品和购物车共用）：每个用户一个桶，另有全站一个桶"""
+    return [(RATE_LIMITS['order_user'], current_user.id), (RATE_LIMITS['order_global'], 'all')]
+
+def login_admission_buckets():
+    """登录：尚未认证，按客户端地址限流，另有全站一个桶"""
+    return [(RATE_LIMITS['login_client'], request.remote_addr or 'unknown'), (RATE_LIMITS['login_global'], 'all')]
+
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """每个新的 SQLite 连接都应用存储配置中的 PRAGMA"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        if value != '':
+            cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+# 开始时间记在语句自己的执行上下文上：执行失败的语句没有 after_cursor_execute，
+# 上下文随语句一起丢弃，不会在连接上留下残余
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.sql_timer_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_sql_metrics(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'sql_timer_started', None)
+    elapsed = time.perf_counter() - started if started is not None else 0.0
+    SQL_STATEMENTS.inc()
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_seconds += elapsed
 
 # 用户模型
 class User(UserMixin, db.Model):
@@ -144,7 +429,7 @@ class User(UserMixin, db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False, index=True)
-    password = db.Column(db.String(120), nullable=False)
+    password = db.Column(db.String(255), nullable=False)  # scrypt 哈希约 160 个字符
     phone = db.Column(db.String(20))
     address = db.Column(db.String(100))
     is_admin = db.Column(db.Boolean, default=False)
@@ -176,6 +461,13 @@ class Dish(db.Model):
     is_available = db.Column(db.Boolean, default=True)
     order_details = db.relationship('OrderDetail', backref='dish', lazy=True)
 
+class OrderConflictError(Exception):
+    """订单在读取之后已被其他人修改（版本号或状态不符），重新读取后可重试"""
+    
+    def __init__(self, order_id):
+        super().__init__(f"订单 {order_id} 已被其他人修改")
+        self.order_id = order_id
+
 # 订单模型
 class Order(db.Model):
     __tablename__ = 'order'
@@ -188,30 +480,138 @@ class Order(db.Model):
     total_amount = db.Column(db.DECIMAL(10, 2), nullable=False)
     delivery_address = db.Column(db.String(200))
     note = db.Column(db.String(500))
+    # 下单时生成的幂等键，Stream 消息重投递时据此去重
+    ingest_key = db.Column(db.String(32), unique=True)
+    # 乐观并发控制的版本号，每次状态转换加一
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     order_details = db.relationship('OrderDetail', backref='order', lazy=True)
     
     # 添加复合索引
     __table_args__ = (
         db.Index('idx_user_status', user_id, status),
         db.Index('idx_restaurant_status', restaurant_id, status),
-        db.Index('idx_order_time', order_time.desc())
+        db.Index('idx_order_time', order_time.desc()),
+        db.Index('idx_user_order_time', user_id, order_time.desc(), id.desc())
     )
+    # ORM 刷新对订单的修改时同样带上版本号条件，并发修改会抛出 StaleDataError
+    __mapper_args__ = {'version_id_col': version}
+    
+    # 订单状态机：当前状态 -> 允许转换到的状态
+    VALID_TRANSITIONS = {
+        OrderStatus.PENDING: {OrderStatus.PROCESSING, OrderStatus.CANCELLED},
+        OrderStatus.PROCESSING: {OrderStatus.COMPLETED, OrderStatus.CANCELLED},
+        OrderStatus.COMPLETED: set(),
+        OrderStatus.CANCELLED: set()
+    }
     
     def can_transition_to(self, new_status):
         """检查订单状态转换是否有效"""
-        valid_transitions = {
-            OrderStatus.PENDING: [OrderStatus.PROCESSING, OrderStatus.CANCELLED],
-            OrderStatus.PROCESSING: [OrderStatus.COMPLETED, OrderStatus.CANCELLED],
-            OrderStatus.COMPLETED: [],
-            OrderStatus.CANCELLED: []
-        }
-        return new_status in valid_transitions.get(self.status, [])
-
-    def transition_to(self, new_status):
-        """转换订单状态"""
+        return new_status in self.VALID_TRANSITIONS.get(self.status, set())
+    
+    @classmethod
+    def source_statuses(cls, new_status):
+        """可以转换到 new_status 的全部状态"""
+        return {status for status, targets in cls.VALID_TRANSITIONS.items() if new_status in targets}
+    
+    @classmethod
+    def bulk_transition(cls, order_ids, new_status):
+        """批量转换订单状态
+        
+        按当前状态分组，每组执行一条 UPDATE ... WHERE id IN (...) AND status = ...，
+        期间被其他人改过状态的订单不会被覆盖。调用方负责提交事务。
+        返回 ({订单ID: 结果}, 被更新订单的用户ID集合)，结果为
+        'updated' / 'not_found' / 'invalid'（状态机不允许）/ 'conflict'（状态已被并发修改）。
+        """
+        order_ids = set(order_ids)
+        sources = cls.source_statuses(new_status)
+        current = dict(db.session.execute(
+            db.select(cls.id, cls.status).where(cls.id.in_(order_ids))
+        ).all())
+        
+        outcomes = {}
+        groups = defaultdict(list)
+        for order_id in order_ids:
+            status = current.get(order_id)
+            if status is None:
+                outcomes[order_id] = 'not_found'
+            elif status not in sources:
+                outcomes[order_id] = 'invalid'
+            else:
+                groups[status].append(order_id)
+        
+        user_ids = set()
+        delta = SalesDelta()
+        cancelled_ids = []
+        for status, ids in groups.items():
+            updated = db.session.execute(
+                db.update(cls)
+                .where(cls.id.in_(ids), cls.status == status)
+                .values(status=new_status, version=cls.version + 1)
+                .returning(cls.id, cls.user_id, cls.restaurant_id, cls.status, cls.version,
+                           cls.order_time, cls.total_amount)
+                .execution_options(synchronize_session=False)
+            ).all()
+            for row in updated:
+                outcomes[row.id] = 'updated'
+                user_ids.add(row.user_id)
+                record_order_event('transitioned', row, old_status=status)
+            for order_id in ids:
+                outcomes.setdefault(order_id, 'conflict')
+            delta.move_status(status, new_status, len(updated))
+            if new_status == OrderStatus.CANCELLED:
+                cancelled_ids.extend(row.id for row in updated)
+        
+        # 取消的订单从营业额和菜品销量中扣除
+        if cancelled_ids:
+            details = defaultdict(list)
+            for row in db.session.execute(
+                db.select(OrderDetail.order_id, OrderDetail.dish_id, OrderDetail.quantity, OrderDetail.subtotal)
+                .where(OrderDetail.order_id.in_(cancelled_ids))
+            ):
+                details[row.order_id].append((row.dish_id, row.quantity, row.subtotal))
+            for row in db.session.execute(
+                db.select(cls.id, cls.restaurant_id, cls.order_time, cls.total_amount)
+                .where(cls.id.in_(cancelled_ids))
+            ):
+                delta.add_order(row.restaurant_id, row.order_time, row.total_amount, details[row.id], sign=-1)
+        delta.apply()
+        
+        updated_count = sum(1 for outcome in outcomes.values() if outcome == 'updated')
+        logging.info(f"批量将 {updated_count} 个订单状态更新为 {new_status.value}")
+        return outcomes, user_ids
+
+    def transition_to(self, new_status, expected_version=None):
+        """转换订单状态（乐观并发控制）
+        
+        用一条 UPDATE ... WHERE id = ? AND version = ? AND status = ? 完成校验和修改，
+        不加锁；读取之后被其他人改过的订单影响 0 行，抛出 OrderConflictError，
+        调用方回滚后重新读取即可重试。expected_version 为页面上看到的版本号，
+        默认使用本对象加载时的版本号。调用方负责提交事务。
+        """
         if not self.can_transition_to(new_status):
             raise ValueError(f"不能从 {self.status.value} 转换到 {new_status.value}")
-        self.status = new_status
+        version = self.version if expected_version is None else expected_version
+        row = db.session.execute(
+            db.update(Order)
+            .where(Order.id == self.id, Order.version == version, Order.status == self.status)
+            .values(status=new_status, version=Order.version + 1)
+            .returning(Order.version)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if row is None:
+            raise OrderConflictError(self.id)
+        old_status = self.status
+        set_committed_value(self, 'status', new_status)
+        set_committed_value(self, 'version', row.version)
+        record_order_event('transitioned', self, old_status=old_status)
+        
+        # 同一事务内更新销售汇总表
+        delta = SalesDelta()
+        delta.move_status(old_status, new_status)
+        if new_status == OrderStatus.CANCELLED:
+            delta.add_order(self.restaurant_id, self.order_time, self.total_amount,
+                            [(d.dish_id, d.quantity, d.subtotal) for d in self.order_details], sign=-1)
+        delta.apply()
         logging.info(f"订单 {self.id} 状态更新为 {new_status.value}")
 
 # 订单明细模型
@@ -219,7 +619,8 @@ class OrderDetail(db.Model):
     __tablename__ = 'order_detail'
     
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    # 订单列表补齐明细、取消订单和归档都按订单ID查找明细
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
     dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.DECIMAL(10, 2), nullable=False)
@@ -230,6 +631,37 @@ class OrderDetail(db.Model):
         if self.unit_price and self.quantity:
             self.subtotal = self.unit_price * self.quantity
 
+# 归档订单：已完成/已取消且早于 ORDER_ARCHIVE_DAYS 天的订单由 archiver.py 从订单表整批移入，
+# 列与订单表相同（保留原订单ID），订单表及其索引只保留近期订单
+class ArchivedOrder(db.Model):
+    __tablename__ = 'order_archive'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurant.id'), nullable=False)
+    order_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.Enum(OrderStatus), nullable=False)
+    total_amount = db.Column(db.DECIMAL(10, 2), nullable=False)
+    delivery_address = db.Column(db.String(200))
+    note = db.Column(db.String(500))
+    ingest_key = db.Column(db.String(32))
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    
+    __table_args__ = (
+        db.Index('idx_archive_order_time', order_time.desc()),
+        db.Index('idx_archive_user_order_time', user_id, order_time.desc(), id.desc())
+    )
+
+class ArchivedOrderDetail(db.Model):
+    __tablename__ = 'order_detail_archive'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order_archive.id'), nullable=False, index=True)
+    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.DECIMAL(10, 2), nullable=False)
+    subtotal = db.Column(db.DECIMAL(10, 2), nullable=False)
+
 # 用户收藏模型
 class UserFavorite(db.Model):
     __tablename__ = 'user_favorite'
@@ -241,9 +673,933 @@ class UserFavorite(db.Model):
 
     __table_args__ = (db.UniqueConstraint('user_id', 'restaurant_id', name='unique_user_restaurant'),)
 
+# 销售汇总表：随订单写入和状态变化增量维护，统计口径为未取消的订单
+class RestaurantDailySales(db.Model):
+    __tablename__ = 'restaurant_daily_sales'
+    
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurant.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.DECIMAL(12, 2), nullable=False, default=0)
+
+class OrderStatusCount(db.Model):
+    __tablename__ = 'order_status_count'
+    
+    status = db.Column(db.Enum(OrderStatus), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+
+class DishSales(db.Model):
+    __tablename__ = 'dish_sales'
+    
+    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), primary_key=True)
+    units_sold = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.DECIMAL(12, 2), nullable=False, default=0)
+
+# 分片模式下各分片的ID分配器：分片 k 只分配 ID % 分片数 == k 的ID，订单和明细ID全局唯一
+class OrderIdSequence(db.Model):
+    __tablename__ = 'order_id_sequence'
+    
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+def _dialect_insert(model):
+    dialect = db.session.get_bind(mapper=model).dialect.name
+    return (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(model)
+
+def allocate_shard_ids(model, count):
+    """在当前分片的事务中预留 count 个 model 表的ID
+
+    一条 upsert 递增计数并返回新值，该语句取得的写锁持有到事务结束，
+    并发写入同一分片的事务不会拿到相同的ID；事务回滚时预留的ID一并回滚
+    """
+    stmt = _dialect_insert(OrderIdSequence).values(name=model.__tablename__, value=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name'], set_={'value': OrderIdSequence.value + stmt.excluded.value}
+    ).returning(OrderIdSequence.value)
+    last = db.session.execute(stmt).scalar_one()
+    return [seq * order_shards.count + order_shards.current for seq in range(last - count + 1, last + 1)]
+
+def _upsert_increment(model, key_columns, rows):
+    """INSERT ... ON CONFLICT DO UPDATE SET 列 = 列 + excluded.列，一批行一条语句"""
+    if not rows:
+        return
+    stmt = _dialect_insert(model)
+    value_columns = [c for c in rows[0] if c not in key_columns]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={c: getattr(model, c) + getattr(stmt.excluded, c) for c in value_columns}
+    )
+    db.session.execute(stmt, rows)
+
+class SalesDelta:
+    """累积一批订单对汇总表的增量，apply() 时每张表一条 upsert"""
+    
+    def __init__(self):
+        self.daily = defaultdict(lambda: [0, Decimal('0')])
+        self.statuses = defaultdict(int)
+        self.dishes = defaultdict(lambda: [0, Decimal('0')])
+    
+    def add_order(self, restaurant_id, order_time, total_amount, details, sign=1):
+        """计入（sign=-1 时扣除）一个订单的营业额与菜品销量，details 为 [(菜品ID, 数量, 小计)]"""
+        daily = self.daily[(restaurant_id, order_time.date())]
+        daily[0] += sign
+        daily[1] += sign * Decimal(total_amount)
+        for dish_id, quantity, subtotal in details:
+            dish = self.dishes[dish_id]
+            dish[0] += sign * quantity
+            dish[1] += sign * Decimal(subtotal)
+    
+    def move_status(self, old_status, new_status, count=1):
+        if old_status is not None:
+            self.statuses[old_status] -= count
+        self.statuses[new_status] += count
+    
+    def apply(self):
+        _upsert_increment(RestaurantDailySales, ['restaurant_id', 'day'], [
+            {'restaurant_id': r, 'day': day, 'order_count': n, 'revenue': revenue}
+            for (r, day), (n, revenue) in self.daily.items()
+        ])
+        _upsert_increment(OrderStatusCount, ['status'], [
+            {'status': status, 'order_count': n} for status, n in self.statuses.items() if n
+        ])
+        _upsert_increment(DishSales, ['dish_id'], [
+            {'dish_id': dish_id, 'units_sold': units, 'revenue': revenue}
+            for dish_id, (units, revenue) in self.dishes.items()
+        ])
+
+def compute_sales_aggregates():
+    """根据订单和明细（含归档表）从头计算汇总表应有的内容（分片模式下为当前分片）"""
+    delta = SalesDelta()
+    for model, detail_model in ORDER_TABLES:
+        active = model.status != OrderStatus.CANCELLED
+        rows = db.session.execute(
+            db.select(model.restaurant_id, model.order_time, model.total_amount)
+            .where(active).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        for row in rows:
+            delta.add_order(row.restaurant_id, row.order_time, row.total_amount, [])
+        for dish_id, units, revenue in db.session.execute(
+            db.select(detail_model.dish_id, db.func.sum(detail_model.quantity), db.func.sum(detail_model.subtotal))
+            .join(model, detail_model.order_id == model.id).where(active).group_by(detail_model.dish_id)
+        ):
+            dish = delta.dishes[dish_id]
+            dish[0] += units
+            dish[1] += Decimal(str(revenue))
+        for status, count in db.session.execute(
+            db.select(model.status, db.func.count()).group_by(model.status)
+        ):
+            delta.statuses[status] += count
+    return delta
+
+def stored_sales_aggregates():
+    """读取汇总表当前的内容（分片模式下为当前分片）
+
+    按列读取而不加载 ORM 对象：各分片的 order_status_count 主键相同，
+    同一会话中依次读取多个分片时标识映射会把它们当成同一行
+    """
+    delta = SalesDelta()
+    for row in db.session.execute(db.select(RestaurantDailySales.restaurant_id, RestaurantDailySales.day,
+                                            RestaurantDailySales.order_count, RestaurantDailySales.revenue)):
+        delta.daily[(row.restaurant_id, row.day)] = [row.order_count, row.revenue]
+    for row in db.session.execute(db.select(OrderStatusCount.status, OrderStatusCount.order_count)):
+        delta.statuses[row.status] = row.order_count
+    for row in db.session.execute(db.select(DishSales.dish_id, DishSales.units_sold, DishSales.revenue)):
+        delta.dishes[row.dish_id] = [row.units_sold, row.revenue]
+    return delta
+
+def sales_aggregate_drift(expected, actual):
+    """对比两份汇总，返回 [(表, 键, 应有值, 实际值)]"""
+    def normalize(value):
+        if isinstance(value, list):
+            return (value[0], Decimal(value[1]).quantize(Decimal('0.01')))
+        return value
+    drift = []
+    for table, want, have in (('restaurant_daily_sales', expected.daily, actual.daily),
+                              ('order_status_count', expected.statuses, actual.statuses),
+                              ('dish_sales', expected.dishes, actual.dishes)):
+        zero = normalize([0, 0]) if table != 'order_status_count' else 0
+        for key in set(want) | set(have):
+            w = normalize(want[key]) if key in want else zero
+            h = normalize(have[key]) if key in have else zero
+            if w != h:
+                drift.append((table, key, w, h))
+    return drift
+
+def build_order_payload(user, lines, note=None):
+    """构造可序列化的订单数据，供批处理队列或 Redis Stream 传递
+
+    lines 为 [(菜品, 数量), ...]，菜品为包含 id、price、restaurant_id 的字典或行
+    """
+    details = []
+    total_amount = Decimal('0')
+    for dish, quantity in lines:
+        unit_price = Decimal(str(dish['price']))
+        
+        # 数据验证
+        if quantity <= 0:
+            raise ValueError("订单数量必须大于0")
+        if unit_price <= 0:
+            raise ValueError("单价必须大于0")
+        
+        subtotal = unit_price * quantity
+        total_amount += subtotal
+        details.append({
+            'dish_id': dish['id'],
+            'quantity': quantity,
+            'unit_price': str(unit_price),
+            'subtotal': str(subtotal)
+        })
+    
+    if not details:
+        raise ValueError("订单中没有菜品")
+    restaurant_ids = {dish['restaurant_id'] for dish, _ in lines}
+    if len(restaurant_ids) > 1:
+        raise ValueError("一个订单只能包含同一家餐厅的菜品")
+    
+    return {
+        'ingest_key': uuid.uuid4().hex,
+        'user_id': user.id,
+        'restaurant_id': restaurant_ids.pop(),
+        'order_time': datetime.utcnow().isoformat(),
+        'total_amount': str(total_amount),
+        'delivery_address': user.address,
+        'note': note,
+        'details': details
+    }
+
+def build_cart_payload(user, items, note=None):
+    """结算购物车：一条 IN 查询取出全部菜品，一次遍历算出明细小计和总金额
+
+    items 为 [(菜品ID, 数量), ...]，同一菜品出现多次时数量累加
+    """
+    quantities = defaultdict(int)
+    for dish_id, quantity in items:
+        if quantity:
+            quantities[dish_id] += quantity
+    if not quantities:
+        raise ValueError("购物车是空的")
+    
+    dishes = {
+        row.id: row._mapping for row in db.session.execute(
+            db.select(Dish.id, Dish.name, Dish.price, Dish.restaurant_id, Dish.is_available)
+            .where(Dish.id.in_(quantities))
+        )
+    }
+    lines = []
+    for dish_id, quantity in quantities.items():
+        dish = dishes.get(dish_id)
+        if dish is None:
+            raise ValueError(f"菜品 {dish_id} 不存在")
+        if not dish['is_available']:
+            raise ValueError(f"{dish['name']} 已下架")
+        lines.append((dish, quantity))
+    return build_order_payload(user, lines, note)
+
+def save_order_payloads(payloads):
+    """在一个事务中批量写入订单及明细，已写入过的幂等键会被跳过
+
+    分片模式下按餐厅分组，每个分片一个事务；某个分片失败时已提交的分片不会回滚，
+    整批重试时按幂等键跳过
+    """
+    groups = defaultdict(list)
+    for payload in payloads:
+        groups[order_shards.shard_for_restaurant(payload['restaurant_id'])].append(payload)
+    orders = []
+    for shard, group in groups.items():
+        with order_shards.use(shard):
+            orders.extend(_save_order_payloads(group))
+    return orders
+
+def _save_order_payloads(payloads):
+    keys = [p['ingest_key'] for p in payloads]
+    seen = set(db.session.scalars(
+        db.select(Order.ingest_key).where(Order.ingest_key.in_(keys))
+    ))
+    
+    orders = []
+    for payload in payloads:
+        if payload['ingest_key'] in seen:
+            continue
+        seen.add(payload['ingest_key'])
+        orders.append(Order(
+            ingest_key=payload['ingest_key'],
+            user_id=payload['user_id'],
+            restaurant_id=payload['restaurant_id'],
+            order_time=datetime.fromisoformat(payload['order_time']),
+            total_amount=Decimal(payload['total_amount']),
+            delivery_address=payload['delivery_address'],
+            note=payload['note'],
+            order_details=[
+                OrderDetail(
+                    dish_id=d['dish_id'],
+                    quantity=d['quantity'],
+                    unit_price=Decimal(d['unit_price']),
+                    subtotal=Decimal(d['subtotal'])
+                )
+                for d in payload['details']
+            ]
+        ))
+    
+    if order_shards.enabled and orders:
+        # 分片之间各自分配ID，由分配器保证全局唯一且能按ID找到分片
+        order_ids = iter(allocate_shard_ids(Order, len(orders)))
+        detail_ids = iter(allocate_shard_ids(OrderDetail, sum(len(o.order_details) for o in orders)))
+        for order in orders:
+            order.id = next(order_ids)
+            for detail in order.order_details:
+                detail.id = next(detail_ids)
+    db.session.add_all(orders)
+    
+    # 同一事务内更新销售汇总表
+    delta = SalesDelta()
+    for order in orders:
+        delta.add_order(order.restaurant_id, order.order_time, order.total_amount,
+                        [(d.dish_id, d.quantity, d.subtotal) for d in order.order_details])
+    delta.move_status(None, OrderStatus.PENDING, len(orders))
+    delta.apply()
+    
+    user_ids = {o.user_id for o in orders}
+    db.session.commit()
+    if orders:
+        invalidate_order_lists(user_ids)
+    return orders
+
+# 订单列表使用的轻量只读行，不进入 ORM 标识映射，也不会触发延迟加载
+OrderRow = namedtuple('OrderRow', 'id user_id username restaurant_id order_time status total_amount version details')
+OrderDetailRow = namedtuple('OrderDetailRow', 'dish_id dish_name quantity unit_price subtotal')
+
+# 订单表与归档表（列相同）及各自的明细表
+ORDER_TABLES = ((Order, OrderDetail), (ArchivedOrder, ArchivedOrderDetail))
+
+def archive_boundary():
+    """归档分界时间：归档表中只有早于该时间的订单；未启用归档时返回 None"""
+    days = app.config['ORDER_ARCHIVE_DAYS']
+    return datetime.utcnow() - timedelta(days=days) if days > 0 else None
+
+def order_list_select(user_id=None, model=Order):
+    """订单列表的列投影查询（不含排序），model 为订单表或归档表
+
+    分片模式下订单表与用户表不在同一个库，用户名列为空，由 OrderKeysetPage 补齐
+    """
+    username = db.null().label('username') if order_shards.enabled else User.username
+    stmt = db.select(
+        model.id, model.user_id, username, model.restaurant_id,
+        model.order_time, model.status, model.total_amount, model.version
+    )
+    if not order_shards.enabled:
+        stmt = stmt.join(User, model.user_id == User.id)
+    if user_id is not None:
+        stmt = stmt.where(model.user_id == user_id)
+    return stmt
+
+def load_order_details(order_ids, detail_model=OrderDetail):
+    """用一条 IN 查询取出订单的明细和菜品名，返回 {订单ID: [OrderDetailRow, ...]}
+
+    分片模式下订单ID按所在分片分组，每个分片一条 IN 查询，菜品名取自菜单目录缓存
+    """
+    details = defaultdict(list)
+    if not order_shards.enabled:
+        if order_ids:
+            detail_rows = db.session.execute(
+                db.select(
+                    detail_model.order_id, detail_model.dish_id, Dish.name,
+                    detail_model.quantity, detail_model.unit_price, detail_model.subtotal
+                ).join(Dish, detail_model.dish_id == Dish.id)
+                .where(detail_model.order_id.in_(order_ids))
+                .order_by(detail_model.id)
+            )
+            for row in detail_rows:
+                details[row.order_id].append(OrderDetailRow(*row[1:]))
+        return details
+    
+    dish_names = {d['id']: d['name'] for d in catalog_dishes()} if order_ids else {}
+    for shard, ids in order_shards.partition(order_ids).items():
+        with order_shards.use(shard):
+            detail_rows = db.session.execute(
+                db.select(
+                    detail_model.order_id, detail_model.dish_id, detail_model.quantity,
+                    detail_model.unit_price, detail_model.subtotal
+                ).where(detail_model.order_id.in_(ids)).order_by(detail_model.id)
+            ).all()
+        for row in detail_rows:
+            details[row.order_id].append(OrderDetailRow(
+                row.dish_id, dish_names.get(row.dish_id), row.quantity, row.unit_price, row.subtotal))
+    return details
+
+def usernames(user_ids):
+    """{用户ID: 用户名}，分片模式下补齐订单列表和导出中的用户名"""
+    if not user_ids:
+        return {}
+    return dict(db.session.execute(db.select(User.id, User.username).where(User.id.in_(user_ids))).all())
+
+# 游标对 (order_time, id) 签名编码，前端只能原样传回
+cursor_serializer = URLSafeSerializer(app.config['SECRET_KEY'], salt='order-cursor')
+
+def encode_order_cursor(row):
+    return cursor_serializer.dumps([row.order_time.isoformat(), row.id])
+
+def decode_order_cursor(token):
+    """解析游标，无效或被篡改的游标返回 None（回到第一页）"""
+    try:
+        order_time, order_id = cursor_serializer.loads(token)
+        return datetime.fromisoformat(order_time), int(order_id)
+    except (BadSignature, ValueError, TypeError):
+        return None
+
+class OrderKeysetPage:
+    """按 (order_time, id) 倒序的游标分页
+
+    每页只按索引定位游标位置后读取 per_page + 1 行，代价与翻到第几页无关；
+    total 默认不计算，需要时传入 with_total=True。
+    select_for(model) 返回订单表或归档表的列投影查询。传入归档分界时间 boundary 后，
+    只有本页范围早于分界（翻到订单表的末尾，或游标本身早于分界）时才同时读取归档表，
+    两表各取 per_page + 1 行后按游标顺序合并。分片模式下每个分片同样各取
+    per_page + 1 行再合并（scatter-gather），游标格式不变。
+    """
+    
+    def __init__(self, select_for, after=None, before=None, per_page=20, with_total=False, boundary=None):
+        self.per_page = per_page
+        key = decode_order_cursor(before or after) if (before or after) else None
+        backwards = key is not None and before is not None
+        
+        rows = self._gather(select_for, Order, key, backwards)
+        archived = []
+        if boundary is not None:
+            if backwards:
+                reaches = key[0] < boundary
+            else:
+                reaches = len(rows) <= per_page or rows[-1].order_time < boundary
+            if reaches:
+                archived = self._gather(select_for, ArchivedOrder, key, backwards)
+        if archived:
+            rows = sorted(rows + archived, key=lambda r: (r.order_time, r.id), reverse=not backwards)
+            rows = rows[:per_page + 1]
+        
+        # 明细按所在的表分别补齐，各一条 IN 查询
+        archived_ids = {r.id for r in archived}
+        details = load_order_details([r.id for r in rows if r.id not in archived_ids])
+        if archived_ids:
+            details.update(load_order_details([r.id for r in rows if r.id in archived_ids], ArchivedOrderDetail))
+        items = [OrderRow(*r, details=details[r.id]) for r in rows]
+        if order_shards.enabled:
+            names = usernames({r.user_id for r in items})
+            items = [r._replace(username=names.get(r.user_id)) for r in items]
+        has_more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+            self.has_prev, self.has_next = has_more, True
+        else:
+            self.has_prev, self.has_next = key is not None, has_more
+        
+        self.items = items
+        self.next_cursor = encode_order_cursor(items[-1]) if items and self.has_next else None
+        self.prev_cursor = encode_order_cursor(items[0]) if items and self.has_prev else None
+        self.total = None
+        if with_total:
+            models = (Order,) if boundary is None else (Order, ArchivedOrder)
+            self.total = sum(
+                db.session.execute(db.select(db.func.count()).select_from(select_for(m).subquery())).scalar()
+                for _ in order_shards.each() for m in models
+            )
+    
+    def _gather(self, select_for, model, key, backwards):
+        rows = []
+        for _ in order_shards.each():
+            rows.extend(self._fetch(select_for(model), model, key, backwards))
+        if order_shards.enabled:
+            rows = sorted(rows, key=lambda r: (r.order_time, r.id), reverse=not backwards)[:self.per_page + 1]
+        return rows
+    
+    def _fetch(self, stmt, model, key, backwards):
+        if key is None:
+            page_stmt = stmt.order_by(model.order_time.desc(), model.id.desc())
+        elif backwards:
+            # 向前翻页：升序取游标之后（更新）的订单，再翻转回倒序
+            order_time, order_id = key
+            page_stmt = stmt.where(db.or_(
+                model.order_time > order_time,
+                db.and_(model.order_time == order_time, model.id > order_id)
+            )).order_by(model.order_time.asc(), model.id.asc())
+        else:
+            order_time, order_id = key
+            page_stmt = stmt.where(db.or_(
+                model.order_time < order_time,
+                db.and_(model.order_time == order_time, model.id < order_id)
+            )).order_by(model.order_time.desc(), model.id.desc())
+        return db.session.execute(page_stmt.limit(self.per_page + 1)).all()
+    
+    def __iter__(self):
+        return iter(self.items)
+
+def order_list_page(user, after=None, before=None, per_page=20, with_total=False):
+    """当前用户可见的一页订单：管理员看全部，普通用户只看自己的"""
+    user_id = None if user.is_admin else user.id
+    return OrderKeysetPage(lambda model: order_list_select(user_id, model), after=after, before=before,
+                           per_page=per_page, with_total=with_total, boundary=archive_boundary())
+
+# 菜单目录缓存：进程内 LRU + Redis，菜品或餐厅变更时递增版本号使所有进程的旧菜单失效
+catalog_cache = VersionedCache(
+    cache_redis, 'catalog',
+    on_lookup=lambda result: CACHE_REQUESTS.inc(cache='catalog', result=result)
+)
+
+def _dish_select():
+    return db.select(
+        Dish.id, Dish.name, Dish.description, Dish.price, Dish.restaurant_id,
+        Dish.is_available, Restaurant.name.label('restaurant_name')
+    ).join(Restaurant, Dish.restaurant_id == Restaurant.id)
+
+def catalog_dishes(restaurant_id=None):
+    """菜品列表（字典），可按餐厅过滤"""
+    def load():
+        stmt = _dish_select()
+        if restaurant_id is not None:
+            stmt = stmt.where(Dish.restaurant_id == restaurant_id)
+        return [dict(row._mapping) for row in db.session.execute(stmt.order_by(Dish.id))]
+    name = 'dishes' if restaurant_id is None else f'dishes:restaurant:{restaurant_id}'
+    return catalog_cache.get(name, load)
+
+def catalog_dish(dish_id):
+    """单个菜品（字典），不存在时返回 None"""
+    def load():
+        row = db.session.execute(_dish_select().where(Dish.id == dish_id)).first()
+        return dict(row._mapping) if row else None
+    return catalog_cache.get(f'dish:{dish_id}', load)
+
+def catalog_restaurants():
+    """餐厅列表（字典），附带菜品数量"""
+    def load():
+        stmt = db.select(
+            Restaurant.id, Restaurant.name, Restaurant.address, Restaurant.phone,
+            Restaurant.description, db.func.count(Dish.id).label('dish_count')
+        ).outerjoin(Dish, Dish.restaurant_id == Restaurant.id)\
+            .group_by(Restaurant.id).order_by(Restaurant.id)
+        return [dict(row._mapping) for row in db.session.execute(stmt)]
+    return catalog_cache.get('restaurants', load)
+
+def catalog_restaurant(restaurant_id):
+    """单个餐厅（字典），不存在时返回 None"""
+    def load():
+        restaurant = db.session.get(Restaurant, restaurant_id)
+        if not restaurant:
+            return None
+        return {'id': restaurant.id, 'name': restaurant.name, 'address': restaurant.address,
+                'phone': restaurant.phone, 'description': restaurant.description}
+    return catalog_cache.get(f'restaurant:{restaurant_id}', load)
+
+# 用户收藏的餐厅ID集合，按用户缓存，收藏变更时删除；与登录身份一样只存 Redis、不进 L1，
+# 收藏后重定向到其他进程时也能看到最新状态
+def favorite_ids_cache_key(user_id):
+    return f'user:favorites:{user_id}'
+
+def favorite_restaurant_ids(user_id):
+    key = favorite_ids_cache_key(user_id)
+    ids = cache.get(key, shared_only=True)
+    if ids is None:
+        CACHE_REQUESTS.inc(cache='favorites', result='miss')
+        ids = db.session.scalars(
+            db.select(UserFavorite.restaurant_id).where(UserFavorite.user_id == user_id)
+        ).all()
+        cache.set(key, ids, timeout=USER_CACHE_TIMEOUT, shared_only=True)
+    else:
+        CACHE_REQUESTS.inc(cache='favorites', result='hit')
+    return set(ids)
+
+def catalog_dish_choices():
+    return [(d['id'], f"{d['name']} (¥{d['price']})") for d in catalog_dishes() if d['is_available']]
+
+def catalog_restaurant_choices():
+    return [(r['id'], r['name']) for r in catalog_restaurants()]
+
+# 全文检索：菜品和餐厅的名称、描述写入 FTS5 索引，随 ORM 增删改在同一事务内同步
+search_index = SearchIndex()
+SEARCH_KINDS = ('dish', 'restaurant')
+SEARCH_PER_PAGE = 20
+
+@event.listens_for(Dish, 'after_insert')
+@event.listens_for(Dish, 'after_update')
+def index_dish(mapper, connection, target):
+    search_index.upsert(connection, 'dish', target.id, target.name, target.description)
+
+@event.listens_for(Restaurant, 'after_insert')
+@event.listens_for(Restaurant, 'after_update')
+def index_restaurant(mapper, connection, target):
+    search_index.upsert(connection, 'restaurant', target.id, target.name, target.description)
+
+@event.listens_for(Dish, 'after_delete')
+def unindex_dish(mapper, connection, target):
+    search_index.remove(connection, 'dish', target.id)
+
+@event.listens_for(Restaurant, 'after_delete')
+def unindex_restaurant(mapper, connection, target):
+    search_index.remove(connection, 'restaurant', target.id)
+
+def search_documents():
+    """索引重建时使用的全部文档"""
+    for row in db.session.execute(db.select(Restaurant.id, Restaurant.name, Restaurant.description)):
+        yield 'restaurant', row.id, row.name, row.description
+    for row in db.session.execute(db.select(Dish.id, Dish.name, Dish.description)):
+        yield 'dish', row.id, row.name, row.description
+
+def rebuild_search_index():
+    count = search_index.rebuild(db.session.connection(), list(search_documents()))
+    db.session.commit()
+    return count
+
+def _like_search(query, kind):
+    """数据库不支持 FTS5 时的降级查询：名称匹配排在描述匹配之前"""
+    pattern = f"%{query.replace('%', '').replace('_', '')}%"
+    hits = []
+    for model, model_kind in ((Restaurant, 'restaurant'), (Dish, 'dish')):
+        if kind not in (None, model_kind):
+            continue
+        name_match = model.name.ilike(pattern)
+        stmt = db.select(model.id).where(name_match | model.description.ilike(pattern))\
+            .order_by(db.case((name_match, 0), else_=1), model.id)
+        hits.extend((model_kind, ref_id) for ref_id in db.session.scalars(stmt))
+    return hits
+
+def search_catalog(query, kind=None, page=1, per_page=SEARCH_PER_PAGE):
+    """按相关度返回 (命中总数, 当前页结果)，结果为附带 kind 字段的菜单目录字典"""
+    query = (query or '').strip()
+    if not query:
+        return 0, []
+    offset = (page - 1) * per_page
+    connection = db.session.connection()
+    if search_index.ensure(connection):
+        total, hits = search_index.search(connection, query, kind=kind, limit=per_page, offset=offset)
+    else:
+        hits = _like_search(query, kind)
+        total, hits = len(hits), hits[offset:offset + per_page]
+    
+    # 展示数据来自菜单目录缓存，索引只负责排序
+    documents = {}
+    if any(hit_kind == 'dish' for hit_kind, _ in hits):
+        documents.update((('dish', d['id']), d) for d in catalog_dishes())
+    if any(hit_kind == 'restaurant' for hit_kind, _ in hits):
+        documents.update((('restaurant', r['id']), r) for r in catalog_restaurants())
+    results = [dict(documents[hit], kind=hit[0]) for hit in hits if hit in documents]
+    return total, results
+
+# 订单导出：按订单ID分批读取，逐行生成 CSV / NDJSON，内存占用与导出量无关
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_CSV_COLUMNS = [
+    'order_id', 'order_time', 'status', 'user_id', 'username', 'restaurant_id', 'total_amount',
+    'delivery_address', 'note', 'dish_id', 'dish_name', 'quantity', 'unit_price', 'subtotal'
+]
+
+def parse_export_filters(args):
+    """解析导出条件：start / end（YYYY-MM-DD，含当天）、restaurant_id、status（状态值）"""
+    filters = {}
+    if args.get('start'):
+        filters['start'] = datetime.strptime(args['start'], '%Y-%m-%d')
+    if args.get('end'):
+        filters['end'] = datetime.strptime(args['end'], '%Y-%m-%d') + timedelta(days=1)
+    if args.get('restaurant_id'):
+        filters['restaurant_id'] = int(args['restaurant_id'])
+    if args.get('status'):
+        filters['status'] = OrderStatus(args['status'])
+    return filters
+
+# 导出的一行：订单列在前，明细列在后（没有明细的订单明细列为空）
+ExportRow = namedtuple('ExportRow', EXPORT_CSV_COLUMNS)
+
+def export_order_rows(start=None, end=None, restaurant_id=None, status=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """逐行产出订单明细（每个明细一行，没有明细的订单产出一行空明细），按订单号排序
+
+    按订单ID分批读取订单（见 _export_orders），再用 order_id IN (...) 取每批订单的明细，
+    数据库每次只处理一批，不会先把全部结果排好序。
+    起始日期早于归档分界（或未指定）时先产出归档表中的订单，再产出订单表中的订单，
+    同一订单的明细总是相邻。分片模式下按分片依次导出（指定餐厅时只读它所在的分片），
+    用户名和菜品名在每批行中补齐
+    """
+    boundary = archive_boundary()
+    tables = ORDER_TABLES[::-1] if boundary is not None and (start is None or start < boundary) else ORDER_TABLES[:1]
+    if restaurant_id is not None and order_shards.enabled:
+        shards = [order_shards.shard_for_restaurant(restaurant_id)]
+    else:
+        shards = range(order_shards.count)
+    dish_names = {d['id']: d['name'] for d in catalog_dishes()} if order_shards.enabled else None
+    for shard in shards:
+        for model, detail_model in tables:
+            stream = _export_orders(shard, model, start, end, restaurant_id, status, chunk_size)
+            while True:
+                orders = list(itertools.islice(stream, chunk_size))
+                if not orders:
+                    break
+                details = defaultdict(list)
+                with order_shards.use(shard):
+                    for detail in db.session.execute(_export_details_select(detail_model, [o.order_id for o in orders])):
+                        details[detail.order_id].append(detail)
+                names = usernames({o.user_id for o in orders}) if order_shards.enabled else None
+                for order in orders:
+                    head = order._asdict()
+                    if names is not None:
+                        head['username'] = names.get(order.user_id)
+                    for detail in details.get(order.order_id) or [None]:
+                        if detail is None:
+                            yield ExportRow(**head, dish_id=None, dish_name=None, quantity=None,
+                                            unit_price=None, subtotal=None)
+                            continue
+                        dish_name = dish_names.get(detail.dish_id) if dish_names is not None else detail.dish_name
+                        yield ExportRow(**head, dish_id=detail.dish_id, dish_name=dish_name, quantity=detail.quantity,
+                                        unit_price=detail.unit_price, subtotal=detail.subtotal)
+
+def _export_orders(shard, model, start, end, restaurant_id, status, chunk_size):
+    """按订单ID升序产出符合条件的订单，每次查询 id > 上一批最大ID ORDER BY id LIMIT chunk_size
+
+    订单表上只按餐厅或下单时间筛选时，可用的索引（idx_restaurant_status、idx_order_time）
+    不按订单ID排列，每批都要把剩余结果重新排序；此时按状态拆开，每个状态沿
+    (restaurant_id, status, id) 或 (status, id) 的索引顺序读取，再按订单ID归并
+    """
+    if model is Order and status is None and (restaurant_id is not None or start is not None or end is not None):
+        yield from heapq.merge(*(_export_orders(shard, model, start, end, restaurant_id, s, chunk_size)
+                                 for s in OrderStatus), key=lambda order: order.order_id)
+        return
+    stmt = _export_orders_select(model, start, end, restaurant_id, status).limit(chunk_size)
+    last_id = 0
+    while True:
+        with order_shards.use(shard):
+            orders = db.session.execute(stmt.where(model.id > last_id)).all()
+        if not orders:
+            return
+        yield from orders
+        last_id = orders[-1].order_id
+
+def _export_orders_select(model, start, end, restaurant_id, status):
+    if order_shards.enabled:
+        # 订单表与用户表、菜品表不在同一个库，名称由调用方补齐
+        username = db.null().label('username')
+    else:
+        username = User.username
+    stmt = db.select(
+        model.id.label('order_id'), model.order_time, model.status, model.user_id, username,
+        model.restaurant_id, model.total_amount, model.delivery_address, model.note
+    )
+    if not order_shards.enabled:
+        stmt = stmt.join(User, model.user_id == User.id)
+    if start is not None:
+        stmt = stmt.where(model.order_time >= start)
+    if end is not None:
+        stmt = stmt.where(model.order_time < end)
+    if restaurant_id is not None:
+        stmt = stmt.where(model.restaurant_id == restaurant_id)
+    if status is not None:
+        stmt = stmt.where(model.status == status)
+    return stmt.order_by(model.id)
+
+def _export_details_select(detail_model, order_ids):
+    if order_shards.enabled:
+        stmt = db.select(detail_model.order_id, detail_model.dish_id, db.null().label('dish_name'),
+                         detail_model.quantity, detail_model.unit_price, detail_model.subtotal)
+    else:
+        stmt = db.select(detail_model.order_id, detail_model.dish_id, Dish.name.label('dish_name'),
+                         detail_model.quantity, detail_model.unit_price, detail_model.subtotal)\
+            .outerjoin(Dish, detail_model.dish_id == Dish.id)
+    return stmt.where(detail_model.order_id.in_(order_ids)).order_by(detail_model.order_id, detail_model.id)
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, OrderStatus):
+        return value.value
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def export_orders_csv(rows, flush_every=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_export_value(v) for v in row])
+        if i % flush_every == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_orders_ndjson(rows):
+    """每个订单一行 JSON，明细合并到 details 数组（依赖按订单号排序的输入）"""
+    current = None
+    for row in rows:
+        if current is None or current['order_id'] != row.order_id:
+            if current is not None:
+                yield json.dumps(current, ensure_ascii=False) + '\n'
+            current = {name: _export_value(getattr(row, name)) for name in EXPORT_CSV_COLUMNS[:9]}
+            current['details'] = []
+        if row.dish_id is not None:
+            current['details'].append(
+                {name: _export_value(getattr(row, name)) for name in EXPORT_CSV_COLUMNS[9:]}
+            )
+    if current is not None:
+        yield json.dumps(current, ensure_ascii=False) + '\n'
+
+EXPORT_FORMATS = {
+    'csv': (export_orders_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (export_orders_ndjson, 'application/x-ndjson; charset=utf-8')
+}
+
+# 订单列表缓存：按用户、角色和游标缓存分页数据（不缓存渲染结果，避免带上闪现消息）
+ORDER_LIST_CACHE_TIMEOUT = 60
+
+def order_list_tag(user_id=None):
+    """订单列表缓存标签：每个用户一个，管理员共用一个"""
+    return 'orders:tag:admin' if user_id is None else f'orders:tag:user:{user_id}'
+
+def cached_order_list_page(user, after=None, before=None, with_total=False):
+    scope = 'admin' if user.is_admin else f'user:{user.id}'
+    tag = order_list_tag(None if user.is_admin else user.id)
+    # 缓存后端和标签版本在 Redis 不可用时都会退化为进程内实现，这里无需处理 Redis 异常
+    key = tagged_cache_key(f'orders:v2:{scope}:{after}:{before}:{int(with_total)}', [tag])
+    page = cache.get(key)
+    if page is not None:
+        CACHE_REQUESTS.inc(cache='order_list', result='hit')
+        return page
+    CACHE_REQUESTS.inc(cache='order_list', result='miss')
+    page = order_list_page(user, after=after, before=before, with_total=with_total)
+    cache.set(key, page, timeout=ORDER_LIST_CACHE_TIMEOUT)
+    return page
+
+def invalidate_order_lists(user_ids):
+    """使指定用户及管理员的订单列表缓存失效"""
+    invalidate_tags([order_list_tag(uid) for uid in user_ids] + [order_list_tag()])
+
+# 订单事件：在事务中记录，提交后统一发布，回滚则丢弃，订阅方不会看到未提交的数据
+def record_order_event(kind, order, old_status=None):
+    """order 为订单对象或带有相同列名的行，状态和版本号应为转换后的值"""
+    db.session.info.setdefault('order_events', []).append({
+        'type': kind,
+        'order_id': order.id,
+        'user_id': order.user_id,
+        'restaurant_id': order.restaurant_id,
+        'status': order.status.value,
+        'old_status': old_status.value if old_status is not None else None,
+        'version': order.version,
+        'order_time': order.order_time.isoformat(),
+        'total_amount': str(order.total_amount),
+        'at': datetime.utcnow().isoformat(),
+    })
+
+@event.listens_for(Order, 'after_insert')
+def record_order_created(mapper, connection, target):
+    record_order_event('created', target)
+
+@event.listens_for(SQLAlchemySession, 'after_commit')
+def publish_order_events(session):
+    events = session.info.pop('order_events', None)
+    if events:
+        kitchen_board.sync(kitchen_entry(e['order_id'], e['restaurant_id'], e['version'], e['status'],
+                                         datetime.fromisoformat(e['order_time']), e['total_amount'])
+                           for e in events)
+        order_events.publish(events)
+
+@event.listens_for(SQLAlchemySession, 'after_rollback')
+def discard_order_events(session):
+    session.info.pop('order_events', None)
+
+# 后厨看板：只有待处理和准备中的订单上看板，其他状态表示离开看板
+KITCHEN_STATES = {OrderStatus.PENDING.value: 'pending', OrderStatus.PROCESSING.value: 'processing'}
+
+def kitchen_entry(order_id, restaurant_id, version, status, order_time, total_amount):
+    return {'order_id': order_id, 'restaurant_id': restaurant_id, 'version': version,
+            'state': KITCHEN_STATES.get(status), 'order_time': order_time, 'total_amount': total_amount}
+
+def active_kitchen_orders(restaurant_id=None):
+    """数据库中的看板订单（走 idx_restaurant_status），按下单时间升序
+
+    指定餐厅时读取它所在的分片，否则读取当前分片
+    """
+    stmt = db.select(
+        Order.id, Order.restaurant_id, Order.version, Order.status, Order.order_time, Order.total_amount
+    ).where(Order.status.in_([OrderStatus.PENDING, OrderStatus.PROCESSING]))
+    if restaurant_id is None:
+        shard = order_shards.current
+    else:
+        stmt = stmt.where(Order.restaurant_id == restaurant_id)
+        shard = order_shards.shard_for_restaurant(restaurant_id)
+    with order_shards.use(shard):
+        return db.session.execute(
+            stmt.order_by(Order.order_time, Order.id).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+
+def rebuild_kitchen_board():
+    """按数据库中（各分片）的活动订单重建后厨看板，返回上看板的订单数"""
+    return kitchen_board.rebuild(
+        kitchen_entry(row.id, row.restaurant_id, row.version, row.status.value, row.order_time, row.total_amount)
+        for _ in order_shards.each() for row in active_kitchen_orders()
+    )
+
+def kitchen_orders(restaurant_id, limit):
+    """读取看板；看板尚未重建（如 Redis 被清空）时先重建，其他进程正在重建或
+    Redis 不可用时改为查询数据库，返回结构相同"""
+    if kitchen_board.available:
+        try:
+            board = kitchen_board.read(restaurant_id, limit)
+            if board is None and kitchen_board.acquire_rebuild_lock():
+                try:
+                    logging.info(f"后厨看板缺失，已从数据库重建 {rebuild_kitchen_board()} 个订单")
+                finally:
+                    kitchen_board.release_rebuild_lock()
+                board = kitchen_board.read(restaurant_id, limit)
+            if board is not None:
+                return board
+        except RedisError as e:
+            if not isinstance(e, CircuitOpenError):
+                logging.warning(f"读取后厨看板失败，改为查询数据库: {e}")
+    board = {'pending': [], 'processing': []}
+    for row in active_kitchen_orders(restaurant_id):
+        board[KITCHEN_STATES[row.status.value]].append({
+            'id': row.id, 'version': row.version, 'order_time': row.order_time.isoformat(),
+            'total_amount': str(row.total_amount)
+        })
+    board['counts'] = {state: len(orders) for state, orders in board.items()}
+    for state in ('pending', 'processing'):
+        del board[state][limit:]
+    return board
+
+# 登录用户身份缓存：每个请求都要加载当前用户，缓存常用字段后不再查询用户表。
+# 口令哈希不进入缓存，需要时按延迟属性从数据库加载；用户字段变更提交后删除对应条目。
+# 身份条目只存 Redis、不进 L1：撤销管理员或删除用户后，其他进程的下一个请求即可看到
+USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT', '60'))
+USER_CACHE_FIELDS = ('id', 'username', 'phone', 'address', 'is_admin')
+
+def user_cache_key(user_id):
+    return f'user:identity:{user_id}'
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def mark_user_changed(mapper, connection, target):
+    db.session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+@event.listens_for(SQLAlchemySession, 'after_commit')
+def invalidate_user_identities(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        cache.delete(user_cache_key(user_id))
+
+@event.listens_for(SQLAlchemySession, 'after_rollback')
+def discard_user_changes(session):
+    session.info.pop('changed_user_ids', None)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    key = user_cache_key(int(user_id))
+    data = cache.get(key, shared_only=True)
+    if data is None:
+        CACHE_REQUESTS.inc(cache='user', result='miss')
+        user = db.session.get(User, int(user_id))
+        if user is not None:
+            cache.set(key, {name: getattr(user, name) for name in USER_CACHE_FIELDS},
+                      timeout=USER_CACHE_TIMEOUT, shared_only=True)
+        return user
+    
+    CACHE_REQUESTS.inc(cache='user', result='hit')
+    # 由缓存字段构造一个“已持久化”的实例并并入会话（load=False 不查询数据库），
+    # 未缓存的属性标记为过期，访问时才加载
+    user = User(**data)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 # 注册表单
 class RegistrationForm(FlaskForm):
@@ -279,12 +1635,34 @@ class OrderForm(FlaskForm):
     submit = SubmitField('添加到订单')
 
     def validate_dish_id(self, field):
-        dish = Dish.query.get(field.data)
+        dish = catalog_dish(field.data)
         if not dish:
             raise ValidationError('选择的菜品不存在')
-        if not dish.is_available:
+        if not dish['is_available']:
             raise ValidationError('该菜品已下架')
 
+# 收藏/取消收藏餐厅：只有一个提交按钮，表单只负责 CSRF 校验
+class FavoriteForm(FlaskForm):
+    pass
+
+# 批量更新订单状态：订单ID和目标状态由视图解析（同时支持表单和 JSON），表单只负责 CSRF 校验
+class BulkStatusForm(FlaskForm):
+    pass
+
+# 购物车中的一项（嵌套表单，不单独校验 CSRF）
+class CartItemForm(Form):
+    dish_id = HiddenField('菜品', validators=[DataRequired()])
+    quantity = IntegerField('数量', default=0, validators=[
+        Optional(),
+        NumberRange(min=0, max=100, message='数量必须在0-100之间')
+    ])
+
+# 购物车表单
+class CartForm(FlaskForm):
+    items = FieldList(FormField(CartItemForm))
+    note = TextAreaField('备注', validators=[Length(max=500)])
+    submit = SubmitField('提交订单')
+
 # 餐厅表单
 class RestaurantForm(FlaskForm):
     name = StringField('餐厅名称', validators=[DataRequired(), Length(min=1, max=100)])
@@ -313,7 +1691,11 @@ def register():
             return redirect(url_for('register'))
         
         # 创建新用户
-        hashed_password = generate_password_hash(form.password.data)
+        try:
+            hashed_password = password_hasher.hash(form.password.data)
+        except LoginBusyError:
+            flash('注册人数过多，请稍后再试')
+            return render_template('register.html', form=form), 503, {'Retry-After': '1'}
         new_user = User(
             username=form.username.data,
             password=hashed_password,
@@ -330,6 +1712,7 @@ def register():
 
 # 路由：登录
 @app.route('/login', methods=['GET', 'POST'])
+@admission_control(login_admission_buckets)
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -337,7 +1720,16 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user and check_password_hash(user.password, form.password.data):
+        try:
+            valid, new_hash = password_hasher.verify(user.password, form.password.data) if user else (False, None)
+        except LoginBusyError:
+            flash('登录人数过多，请稍后再试')
+            return render_template('login.html', form=form), 503, {'Retry-After': '1'}
+        if valid:
+            if new_hash:
+                # 哈希参数已调整，登录成功时顺带升级存储的口令哈希
+                user.password = new_hash
+                db.session.commit()
             login_user(user)
             flash('登录成功！')
             next_page = request.args.get('next')
@@ -360,11 +1752,13 @@ def logout():
 @app.route('/dishes/<int:restaurant_id>')
 def dishes(restaurant_id=None):
     if restaurant_id:
-        restaurant = Restaurant.query.get_or_404(restaurant_id)
-        dishes = Dish.query.filter_by(restaurant_id=restaurant_id).all()
+        restaurant = catalog_restaurant(restaurant_id)
+        if restaurant is None:
+            abort(404)
+        dishes = catalog_dishes(restaurant_id)
         return render_template('dishes.html', dishes=dishes, restaurant=restaurant)
     else:
-        dishes = Dish.query.all()
+        dishes = catalog_dishes()
         return render_template('dishes.html', dishes=dishes)
 
 # 路由：添加菜品
@@ -376,7 +1770,7 @@ def add_dish():
         return redirect(url_for('dishes'))
     
     form = DishForm()
-    form.restaurant_id.choices = [(r.id, r.name) for r in Restaurant.query.all()]
+    form.restaurant_id.choices = catalog_restaurant_choices()
     
     if form.validate_on_submit():
         dish = Dish(
@@ -387,6 +1781,7 @@ def add_dish():
         )
         db.session.add(dish)
         db.session.commit()
+        catalog_cache.bump()
         flash('菜品添加成功')
         return redirect(url_for('dishes', restaurant_id=dish.restaurant_id))
     return render_template('dish_form.html', form=form, title='添加菜品')
@@ -401,7 +1796,7 @@ def edit_dish(id):
     
     dish = Dish.query.get_or_404(id)
     form = DishForm(obj=dish)
-    form.restaurant_id.choices = [(r.id, r.name) for r in Restaurant.query.all()]
+    form.restaurant_id.choices = catalog_restaurant_choices()
     
     if form.validate_on_submit():
         dish.name = form.name.data
@@ -409,6 +1804,7 @@ def edit_dish(id):
         dish.price = form.price.data
         dish.restaurant_id = form.restaurant_id.data
         db.session.commit()
+        catalog_cache.bump()
         flash('菜品更新成功')
         return redirect(url_for('dishes', restaurant_id=dish.restaurant_id))
     return render_template('dish_form.html', form=form, title='编辑菜品')
@@ -422,16 +1818,24 @@ def delete_dish(id):
         return redirect(url_for('dishes'))
     
     dish = Dish.query.get_or_404(id)
-    db.session.delete(dish)
-    db.session.commit()
+    # 删除时会加载引用该菜品的订单明细，它们在餐厅所在的分片上
+    with order_shards.use(order_shards.shard_for_restaurant(dish.restaurant_id)):
+        db.session.delete(dish)
+        db.session.commit()
+    catalog_cache.bump()
     flash('菜品删除成功')
     return redirect(url_for('dishes'))
 
 # 路由：餐厅列表
 @app.route('/restaurants')
 def restaurants():
-    restaurants = Restaurant.query.all()
-    return render_template('restaurants.html', restaurants=restaurants)
+    restaurants = catalog_restaurants()
+    favorite_ids, favorite_form = set(), None
+    if current_user.is_authenticated and not current_user.is_admin:
+        favorite_ids = favorite_restaurant_ids(current_user.id)
+        favorite_form = FavoriteForm()
+    return render_template('restaurants.html', restaurants=restaurants, favorite_ids=favorite_ids,
+                           favorite_form=favorite_form)
 
 # 路由：添加餐厅
 @app.route('/restaurants/add', methods=['GET', 'POST'])
@@ -451,6 +1855,7 @@ def add_restaurant():
         )
         db.session.add(restaurant)
         db.session.commit()
+        catalog_cache.bump()
         flash('餐厅添加成功')
         return redirect(url_for('restaurants'))
     return render_template('restaurant_form.html', form=form, title='添加餐厅')
@@ -472,6 +1877,7 @@ def edit_restaurant(id):
         restaurant.phone = form.phone.data
         restaurant.description = form.description.data
         db.session.commit()
+        catalog_cache.bump()
         flash('餐厅信息更新成功')
         return redirect(url_for('restaurants'))
     return render_template('restaurant_form.html', form=form, title='编辑餐厅')
@@ -485,16 +1891,35 @@ def delete_restaurant(id):
         return redirect(url_for('restaurants'))
     
     restaurant = Restaurant.query.get_or_404(id)
-    db.session.delete(restaurant)
-    db.session.commit()
+    with order_shards.use(order_shards.shard_for_restaurant(id)):
+        db.session.delete(restaurant)
+        db.session.commit()
+    catalog_cache.bump()
     flash('餐厅删除成功')
     return redirect(url_for('restaurants'))
 
+# 路由：搜索菜品和餐厅
+@app.route('/search')
+def search():
+    query = request.args.get('q', '')
+    kind = request.args.get('type')
+    if kind not in SEARCH_KINDS:
+        kind = None
+    page = max(request.args.get('page', 1, type=int), 1)
+    total, results = search_catalog(query, kind=kind, page=page)
+    pages = (total + SEARCH_PER_PAGE - 1) // SEARCH_PER_PAGE
+    return render_template('search.html', query=query, kind=kind, page=page,
+                           pages=pages, total=total, results=results)
+
 # 路由：收藏/取消收藏餐厅
-@app.route('/restaurants/favorite/<int:id>')
+@app.route('/restaurants/favorite/<int:id>', methods=['POST'])
 @login_required
 def toggle_favorite(id):
-    restaurant = Restaurant.query.get_or_404(id)
+    if catalog_restaurant(id) is None:
+        abort(404)
+    if not FavoriteForm().validate_on_submit():
+        flash('页面已过期，请刷新后重试')
+        return redirect(url_for('restaurants'))
     favorite = UserFavorite.query.filter_by(
         user_id=current_user.id,
         restaurant_id=id
@@ -509,90 +1934,60 @@ def toggle_favorite(id):
         flash('已添加到收藏')
     
     db.session.commit()
+    cache.delete(favorite_ids_cache_key(current_user.id))
     return redirect(url_for('restaurants'))
 
 # 路由：我的收藏
 @app.route('/favorites')
 @login_required
 def favorites():
-    favorites = UserFavorite.query.filter_by(user_id=current_user.id).all()
-    return render_template('restaurants.html', restaurants=[f.restaurant for f in favorites], show_favorites=True)
+    favorite_ids = favorite_restaurant_ids(current_user.id)
+    restaurants = [r for r in catalog_restaurants() if r['id'] in favorite_ids]
+    return render_template('restaurants.html', restaurants=restaurants, favorite_ids=favorite_ids,
+                           favorite_form=FavoriteForm(), show_favorites=True)
 
 # 路由：订单列表
 @app.route('/orders')
 @login_required
-@cache_order(timeout=60)  # 缓存订单列表1分钟
 def orders():
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
-    if current_user.is_admin:
-        # 使用分页查询替代全量加载
-        orders = Order.query.order_by(Order.order_time.desc()).paginate(
-            page=page, per_page=per_page, error_out=False)
-    else:
-        # 使用复合索引优化查询
-        orders = Order.query.filter_by(user_id=current_user.id)\
-            .order_by(Order.order_time.desc())\
-            .paginate(page=page, per_page=per_page, error_out=False)
+    orders = cached_order_list_page(
+        current_user,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        with_total=request.args.get('count', type=int) == 1
+    )
     
-    return render_template('orders.html', orders=orders)
+    bulk_form = BulkStatusForm() if current_user.is_admin else None
+    return render_template('orders.html', orders=orders, bulk_form=bulk_form)
 
 # 路由：创建订单
 @app.route('/order', methods=['GET', 'POST'])
 @login_required
-@validate_data(OrderForm)
+@admission_control(order_admission_buckets)
 @check_data_integrity
 def create_order():
     form = OrderForm()
-    form.dish_id.choices = [(d.id, f"{d.name} (¥{d.price})") 
-                           for d in Dish.query.filter_by(is_available=True).all()]
+    form.dish_id.choices = catalog_dish_choices()
     
     if form.validate_on_submit():
         try:
-            dish = Dish.query.get(form.dish_id.data)
+            dish = catalog_dish(form.dish_id.data)
             if not dish:
                 flash('菜品不存在')
                 return redirect(url_for('create_order'))
             
-            # 创建订单对象
-            order = Order(
-                user_id=current_user.id,
-                restaurant_id=dish.restaurant_id,
-                total_amount=Decimal(str(dish.price * form.quantity.data)),
-                delivery_address=current_user.address,
-                note=form.note.data
-            )
-            
-            order_detail = OrderDetail(
-                order=order,
-                dish_id=dish.id,
-                quantity=form.quantity.data,
-                unit_price=Decimal(str(dish.price)),
-                subtotal=Decimal(str(dish.price * form.quantity.data))
-            )
-            
-            # 数据验证
-            if order_detail.quantity <= 0:
-                raise ValueError("订单数量必须大于0")
-            if order_detail.unit_price <= 0:
-                raise ValueError("单价必须大于0")
-            if order_detail.subtotal != order_detail.unit_price * order_detail.quantity:
-                raise ValueError("订单金额计算错误")
-            
-            # 将订单添加到批处理队列
-            with queue_lock:
-                order_queue.append(order)
-                order_queue.append(order_detail)
+            # 序列化订单并交给写入通道（批处理队列或 Redis Stream）
+            payload = build_order_payload(current_user, [(dish, form.quantity.data)], form.note.data)
+            enqueue_order(payload)
             
-            # 如果队列达到批处理大小，触发处理
-            if len(order_queue) >= BATCH_SIZE:
-                process_order_batch()
-            
-            logging.info(f"用户 {current_user.id} 创建了新订单，订单ID: {order.id}")
+            logging.info(f"用户 {current_user.id} 提交了新订单，幂等键: {payload['ingest_key']}")
             flash('订单创建成功')
             return redirect(url_for('orders'))
             
+        except QueueFullError as e:
+            logging.warning(f"订单队列积压，拒绝新订单: {str(e)}")
+            flash('系统繁忙，请稍后再试')
+            return redirect(url_for('create_order'))
         except Exception as e:
             db.session.rollback()
             logging.error(f"创建订单失败: {str(e)}")
@@ -601,54 +1996,340 @@ def create_order():
     
     return render_template('create_order.html', form=form)
 
+# 路由：购物车下单（同一餐厅的多个菜品合并为一个订单）
+@app.route('/cart/<int:restaurant_id>', methods=['GET', 'POST'])
+@login_required
+@admission_control(order_admission_buckets)
+def cart(restaurant_id):
+    restaurant = catalog_restaurant(restaurant_id)
+    if restaurant is None:
+        abort(404)
+    dishes = {d['id']: d for d in catalog_dishes(restaurant_id) if d['is_available']}
+    
+    form = CartForm()
+    if not form.is_submitted():
+        for dish_id in dishes:
+            form.items.append_entry({'dish_id': dish_id, 'quantity': 0})
+    
+    if form.validate_on_submit():
+        try:
+            items = [(int(entry.dish_id.data), entry.quantity.data or 0) for entry in form.items]
+            payload = build_cart_payload(current_user, items, form.note.data)
+            if payload['restaurant_id'] != restaurant_id:
+                raise ValueError("一个订单只能包含同一家餐厅的菜品")
+            enqueue_order(payload)
+            
+            logging.info(f"用户 {current_user.id} 提交了购物车订单（{len(payload['details'])} 个菜品），"
+                         f"幂等键: {payload['ingest_key']}")
+            flash('订单创建成功')
+            return redirect(url_for('orders'))
+        except QueueFullError as e:
+            logging.warning(f"订单队列积压，拒绝新订单: {str(e)}")
+            flash('系统繁忙，请稍后再试')
+        except ValueError as e:
+            flash(f"创建订单失败: {str(e)}")
+    
+    return render_template('cart.html', form=form, restaurant=restaurant, dishes=dishes)
+
 # 路由：更新订单状态
 @app.route('/orders/<int:id>/status/<status>')
 @login_required
 def update_order_status(id, status):
+    # 后厨看板等页面通过 next 返回原页面，只接受站内路径
+    next_page = request.args.get('next', '')
+    back = next_page if next_page.startswith('/') and not next_page.startswith('//') else url_for('orders')
     if not current_user.is_admin:
         flash('只有管理员可以更新订单状态')
+        return redirect(back)
+    
+    # 订单ID决定所在分片，本次请求的订单查询都在该分片上执行
+    with order_shards.use(order_shards.shard_for_order(id)):
+        try:
+            order = Order.query.get_or_404(id)
+            new_status = OrderStatus(status)
+            
+            # 验证状态转换
+            if not order.can_transition_to(new_status):
+                flash(f'不能将订单从 {order.status.value} 转换为 {new_status.value}')
+                return redirect(back)
+            
+            # 执行状态转换：页面带上的版本号与数据库不一致说明订单已被他人修改
+            order.transition_to(new_status, expected_version=request.args.get('version', type=int))
+            user_id = order.user_id
+            db.session.commit()
+            
+            # 使该用户和管理员的订单列表缓存失效
+            invalidate_order_lists([user_id])
+            
+            logging.info(f"管理员 {current_user.id} 将订单 {id} 状态更新为 {status}")
+            flash('订单状态已更新')
+            
+        except OrderConflictError as e:
+            db.session.rollback()
+            logging.info(f"更新订单状态冲突: {str(e)}")
+            flash(f'订单 #{id} 已被其他人修改，请查看最新状态后重试')
+        except ValueError as e:
+            logging.error(f"更新订单状态失败: {str(e)}")
+            flash(str(e))
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"更新订单状态时发生错误: {str(e)}")
+            flash('更新订单状态失败')
+    
+    return redirect(back)
+
+# 路由：导出订单（流式 CSV / NDJSON）
+@app.route('/admin/orders/export')
+@login_required
+def export_orders():
+    if not current_user.is_admin:
+        flash('只有管理员可以导出订单')
         return redirect(url_for('orders'))
     
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return f'不支持的导出格式: {fmt}', 400
     try:
-        order = Order.query.get_or_404(id)
-        new_status = OrderStatus(status)
-        
-        # 验证状态转换
-        if not order.can_transition_to(new_status):
-            flash(f'不能将订单从 {order.status.value} 转换为 {new_status.value}')
-            return redirect(url_for('orders'))
-        
-        # 执行状态转换
-        order.transition_to(new_status)
-        db.session.commit()
-        
-        # 更新缓存
-        cache_key = f"order_{id}"
-        cache.delete(cache_key)
-        
-        logging.info(f"管理员 {current_user.id} 将订单 {id} 状态更新为 {status}")
-        flash('订单状态已更新')
-        
+        filters = parse_export_filters(request.args)
     except ValueError as e:
-        logging.error(f"更新订单状态失败: {str(e)}")
-        flash(str(e))
+        return f'导出条件错误: {e}', 400
+    
+    render, content_type = EXPORT_FORMATS[fmt]
+    logging.info(f"管理员 {current_user.id} 导出订单，格式 {fmt}，条件 {request.args.to_dict()}")
+    response = Response(stream_with_context(render(export_order_rows(**filters))), content_type=content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename=orders.{fmt}'
+    return response
+
+# 路由：销售看板（只读汇总表）
+@app.route('/admin/dashboard')
+@login_required
+def sales_dashboard():
+    if not current_user.is_admin:
+        flash('只有管理员可以查看销售看板')
+        return redirect(url_for('index'))
+    
+    days = request.args.get('days', 14, type=int)
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    # 分片模式下各分片的汇总表分别读取后合并（按列读取，避免状态计数在标识映射中串行）
+    daily, statuses, top_dishes = [], defaultdict(int), []
+    for _ in order_shards.each():
+        daily += db.session.execute(
+            db.select(RestaurantDailySales.restaurant_id, RestaurantDailySales.day,
+                      RestaurantDailySales.order_count, RestaurantDailySales.revenue)
+            .where(RestaurantDailySales.day >= since)
+        ).all()
+        for status, count in db.session.execute(db.select(OrderStatusCount.status, OrderStatusCount.order_count)):
+            statuses[status] += count
+        top_dishes += db.session.execute(
+            db.select(DishSales.dish_id, DishSales.units_sold, DishSales.revenue)
+            .order_by(DishSales.units_sold.desc()).limit(20)
+        ).all()
+    daily.sort(key=lambda row: (row.day, row.revenue), reverse=True)
+    top_dishes = sorted(top_dishes, key=lambda row: row.units_sold, reverse=True)[:20]
+    
+    # 名称来自菜单目录缓存，不再查询餐厅和菜品表
+    restaurant_names = {r['id']: r['name'] for r in catalog_restaurants()}
+    dish_names = {d['id']: d['name'] for d in catalog_dishes()}
+    return render_template(
+        'dashboard.html', days=days, daily=daily, statuses=statuses, top_dishes=top_dishes,
+        total_revenue=sum((row.revenue for row in daily), Decimal('0')),
+        total_orders=sum(row.order_count for row in daily),
+        restaurant_names=restaurant_names, dish_names=dish_names
+    )
+
+# 路由：后厨看板（读取 Redis 有序集合，不查询数据库）
+@app.route('/admin/kitchen/<int:restaurant_id>')
+@login_required
+def kitchen(restaurant_id):
+    if not current_user.is_admin:
+        flash('只有管理员可以查看后厨看板')
+        return redirect(url_for('index'))
+    
+    restaurant = catalog_restaurant(restaurant_id)
+    if restaurant is None:
+        abort(404)
+    board = kitchen_orders(restaurant_id, app.config['KITCHEN_BOARD_LIMIT'])
+    return render_template('kitchen.html', restaurant=restaurant, board=board)
+
+# 批量状态转换结果说明
+BULK_OUTCOME_MESSAGES = {
+    'not_found': '订单不存在',
+    'invalid': '当前状态不允许该转换',
+    'conflict': '状态已被其他人修改'
+}
+
+# 路由：批量更新订单状态（表单提交或 JSON：{"order_ids": [...], "status": "准备中", "csrf_token": "..."}）
+@app.route('/orders/bulk-status', methods=['POST'])
+@login_required
+def bulk_update_order_status():
+    wants_json = request.is_json
+    if not current_user.is_admin:
+        if wants_json:
+            return jsonify(error='只有管理员可以更新订单状态'), 403
+        flash('只有管理员可以更新订单状态')
+        return redirect(url_for('orders'))
+    
+    # JSON 请求在请求体中带上 csrf_token 字段
+    if not BulkStatusForm().validate_on_submit():
+        if wants_json:
+            return jsonify(error='CSRF 校验失败，请刷新页面后重试'), 400
+        flash('页面已过期，请刷新后重试')
+        return redirect(url_for('orders'))
+    
+    data = (request.get_json(silent=True) or {}) if wants_json else request.form
+    try:
+        new_status = OrderStatus(data.get('status'))
+        raw_ids = data.get('order_ids', []) if wants_json else request.form.getlist('order_ids')
+        order_ids = [int(i) for i in raw_ids]
+    except (ValueError, TypeError) as e:
+        if wants_json:
+            return jsonify(error=f'参数错误: {e}'), 400
+        flash('请选择订单和有效的目标状态')
+        return redirect(url_for('orders'))
+    
+    # 分片模式下每个分片一个事务，各订单的结果互不影响
+    outcomes, user_ids = {}, set()
+    try:
+        for shard, ids in order_shards.partition(order_ids).items():
+            with order_shards.use(shard):
+                shard_outcomes, shard_user_ids = Order.bulk_transition(ids, new_status)
+                db.session.commit()
+            outcomes.update(shard_outcomes)
+            user_ids |= shard_user_ids
     except Exception as e:
         db.session.rollback()
-        logging.error(f"更新订单状态时发生错误: {str(e)}")
-        flash('更新订单状态失败')
+        logging.error(f"批量更新订单状态时发生错误: {str(e)}")
+        if wants_json:
+            return jsonify(error='批量更新订单状态失败'), 500
+        flash('批量更新订单状态失败')
+        return redirect(url_for('orders'))
+    
+    # 所有受影响用户的缓存只失效一次
+    if user_ids:
+        invalidate_order_lists(user_ids)
+    logging.info(f"管理员 {current_user.id} 批量将 {len(order_ids)} 个订单状态更新为 {new_status.value}")
     
+    if wants_json:
+        return jsonify(status=new_status.value,
+                       results={str(order_id): outcome for order_id, outcome in outcomes.items()})
+    
+    updated = [order_id for order_id, outcome in outcomes.items() if outcome == 'updated']
+    flash(f'已将 {len(updated)} 个订单更新为 {new_status.value}')
+    for order_id, outcome in sorted(outcomes.items()):
+        if outcome != 'updated':
+            flash(f'订单 #{order_id} 未更新：{BULK_OUTCOME_MESSAGES[outcome]}')
     return redirect(url_for('orders'))
 
+# 路由：订单事件推送（Server-Sent Events），只对管理员开放（订单页和后厨看板），
+# 可用 restaurant_id 只看某家餐厅；普通用户的订单页刷新后看到最新状态
+@app.route('/orders/events')
+@login_required
+def order_events_stream():
+    if not current_user.is_admin:
+        abort(403)
+    restaurant_id = request.args.get('restaurant_id', type=int)
+    try:
+        subscription = order_events.subscribe(restaurant_id=restaurant_id)
+    except EventBusFullError as e:
+        logging.warning(f"拒绝订单事件连接: {e}")
+        return Response(status=503, headers={'Retry-After': '30'})
+    heartbeat = app.config['ORDER_EVENTS_HEARTBEAT']
+    
+    # 连接期间不占用数据库会话；浏览器断开后写入失败，响应关闭时退订
+    def stream():
+        yield 'retry: 3000\n\n'
+        for item in subscription.events(heartbeat):
+            if item is None:
+                yield ': keepalive\n\n'
+            else:
+                yield f"event: {item['type']}\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+    
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(subscription.close)
+    return response
+
+# 路由：运行指标（Prometheus 文本格式）
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# 命令行：flask --app app export-orders --format ndjson --start 2024-01-01 -o orders.ndjson
+@app.cli.command('export-orders')
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv')
+@click.option('--start', help='起始日期 YYYY-MM-DD')
+@click.option('--end', help='结束日期 YYYY-MM-DD（含当天）')
+@click.option('--restaurant-id', type=int)
+@click.option('--status', type=click.Choice([s.value for s in OrderStatus]))
+@click.option('-o', '--output', type=click.File('w', encoding='utf-8'), default='-')
+def export_orders_command(fmt, start, end, restaurant_id, status, output):
+    """流式导出订单及明细"""
+    filters = parse_export_filters({'start': start, 'end': end,
+                                    'restaurant_id': restaurant_id, 'status': status})
+    render, _ = EXPORT_FORMATS[fmt]
+    for chunk in render(export_order_rows(**filters)):
+        output.write(chunk)
+
+# 命令行：flask --app app rebuild-aggregates [--check]
+@app.cli.command('rebuild-aggregates')
+@click.option('--check', is_flag=True, help='只报告偏差，不改写汇总表')
+def rebuild_aggregates_command(check):
+    """从订单数据重新计算销售汇总表，并报告与现有汇总的偏差（分片模式下逐个分片处理）"""
+    for shard in order_shards.each():
+        prefix = f"分片 {shard}：" if order_shards.enabled else ""
+        expected = compute_sales_aggregates()
+        drift = sales_aggregate_drift(expected, stored_sales_aggregates())
+        for table, key, want, have in drift:
+            click.echo(f"{prefix}{table} {key}: 应为 {want}，实际为 {have}")
+        click.echo(f"{prefix}共发现 {len(drift)} 处偏差")
+        if check:
+            continue
+        
+        RestaurantDailySales.query.delete()
+        OrderStatusCount.query.delete()
+        DishSales.query.delete()
+        expected.apply()
+        db.session.commit()
+        click.echo(f"{prefix}汇总表已重建")
+
+# 命令行：flask --app app rebuild-search-index
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """根据菜品和餐厅表重建全文检索索引"""
+    if not search_index.ensure(db.session.connection()):
+        click.echo("当前数据库不支持 FTS5，搜索使用 LIKE 查询，无需建立索引")
+        return
+    click.echo(f"已索引 {rebuild_search_index()} 条记录")
+
+# 命令行：flask --app app rebuild-kitchen-board
+@app.cli.command('rebuild-kitchen-board')
+def rebuild_kitchen_board_command():
+    """按订单表重建 Redis 中的后厨看板"""
+    if not kitchen_board.available:
+        click.echo("未配置 Redis，后厨看板直接查询数据库，无需重建")
+        return
+    click.echo(f"看板上共有 {rebuild_kitchen_board()} 个订单")
+
+def create_order_shard_tables(drop=False):
+    """在各订单分片上建表（db.create_all 只在主库建表，分片模式下主库中的订单表保持为空）"""
+    tables = [db.metadata.tables[name] for name in ORDER_SHARD_TABLES]
+    for key in order_shards.bind_keys:
+        if drop:
+            db.metadata.drop_all(db.engines[key], tables=tables)
+        db.metadata.create_all(db.engines[key], tables=tables)
+
 # 创建所有数据库表
 def init_db():
     with app.app_context():
         db.drop_all()
         db.create_all()
+        create_order_shard_tables(drop=True)
+        rebuild_search_index()  # drop_all 不会删除 FTS5 虚拟表，清空旧索引
         
         # 创建默认管理员用户
         admin = User(
             username='admin',
-            password=generate_password_hash('admin123'),
+            password=generate_password_hash('admin123', app.config['PASSWORD_HASH_METHOD']),
             is_admin=True
         )
         db.session.add(admin)
@@ -656,5 +2337,13 @@ def init_db():
 
 if __name__ == '__main__':
     init_db()  # 初始化数据库
-    start_background_processing()  # 启动后台处理线程
+    password_hasher.start()  # 预先启动口令哈希进程池
+    if app.config['ORDER_INGEST_MODE'] == 'queue':
+        start_background_processing()  # 启动后台处理线程
+    if kitchen_board.available:
+        with app.app_context():
+            try:
+                rebuild_kitchen_board()  # 从数据库重建后厨看板
+            except RedisError as e:
+                logging.error(f"重建后厨看板失败，看板将读取数据库: {e}")
     app.run(debug=True, port=5001)
\ No newline at end of file
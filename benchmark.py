@@ -0,0 +1,304 @@
+"""HTTP 级压测与性能回归基准
+
+按用户行为比例并发访问 /dishes、/orders、/order、/login 等路由，统计每个路由的
+吞吐量和 p50/p95/p99 延迟，结果保存为 JSON，并可与基线比较，退化超过阈值时以非零状态退出。
+
+用法：
+    python benchmark.py --requests 2000 --concurrency 8 -o results.json
+    python benchmark.py --save-baseline benchmark_baseline.json           # 记录基线
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.2  # 与基线比较
+    python benchmark.py --server                                          # 经由本地 WSGI 服务器（真实 HTTP）
+
+默认通过 Flask 测试客户端在进程内发请求；--server 会在后台线程启动 werkzeug
+多线程服务器，用 urllib 走真实的 HTTP 连接。压测数据（bench_ 开头的用户、餐厅和菜品）
+不存在时自动创建，不会清空已有数据。
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+from app import app, db, User, Restaurant, Dish, catalog_cache, order_queue, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+BENCH_PASSWORD = 'bench123'
+# 默认用户行为比例：浏览菜单最多，其次查看订单，少量下单和登录
+DEFAULT_MIX = {'dishes': 50, 'orders': 30, 'order': 15, 'login': 5}
+
+
+def ensure_bench_data(num_users, num_dishes=10):
+    """创建压测用户、餐厅和菜品（已存在则复用），返回 (用户名列表, 菜品ID列表)"""
+    with app.app_context():
+        restaurant = Restaurant.query.filter_by(name='bench_restaurant').first()
+        if restaurant is None:
+            restaurant = Restaurant(name='bench_restaurant', address='压测地址', phone='13800000000')
+            db.session.add(restaurant)
+            db.session.flush()
+        dishes = Dish.query.filter_by(restaurant_id=restaurant.id).order_by(Dish.id).all()
+        for i in range(len(dishes), num_dishes):
+            dish = Dish(name=f'bench_dish_{i}', price=round(10 + i * 2.5, 2), restaurant_id=restaurant.id)
+            db.session.add(dish)
+            dishes.append(dish)
+
+        usernames = [f'bench_user_{i}' for i in range(num_users)]
+        existing = {u.username for u in User.query.filter(User.username.in_(usernames))}
+        password = generate_password_hash(BENCH_PASSWORD)
+        db.session.add_all(User(username=name, password=password, address='压测地址')
+                           for name in usernames if name not in existing)
+        db.session.commit()
+        catalog_cache.bump()  # 直接写库，需要让菜单缓存失效
+        return usernames, [d.id for d in dishes]
+
+
+class TestClientSession:
+    """进程内会话：Flask 测试客户端，自动保存 Cookie"""
+
+    def __init__(self, base_url=None):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """真实 HTTP 会话：urllib + CookieJar，不跟随重定向（与测试客户端一致）"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+class Benchmark:
+    def __init__(self, usernames, dish_ids, mix=None, concurrency=8, seed=0, session_class=TestClientSession,
+                 base_url=None):
+        self.usernames = usernames
+        self.dish_ids = dish_ids
+        self.mix = mix or DEFAULT_MIX
+        self.concurrency = concurrency
+        self.seed = seed
+        self.session_class = session_class
+        self.base_url = base_url
+        self._samples = defaultdict(list)  # 路由 -> [(耗时, 状态码)]
+        self._lock = threading.Lock()
+
+    def login(self, session, username):
+        return session.request('POST', '/login', {'username': username, 'password': BENCH_PASSWORD})
+
+    def scenario(self, name, session, username, rng):
+        """执行一次用户动作，返回 HTTP 状态码"""
+        if name == 'dishes':
+            return session.request('GET', '/dishes')
+        if name == 'orders':
+            return session.request('GET', '/orders')
+        if name == 'order':
+            return session.request('POST', '/order', {'dish_id': rng.choice(self.dish_ids),
+                                                      'quantity': rng.randint(1, 3), 'note': ''})
+        if name == 'login':
+            # 新会话登录，已登录的会话访问 /login 只会被重定向
+            return self.login(self.session_class(self.base_url), username)
+        raise ValueError(f'未知的压测场景: {name}')
+
+    def _worker(self, worker_id, num_requests, record):
+        rng = random.Random(self.seed * 1000 + worker_id)
+        username = self.usernames[worker_id % len(self.usernames)]
+        session = self.session_class(self.base_url)
+        self.login(session, username)
+        names, weights = zip(*self.mix.items())
+        samples = []
+        for name in rng.choices(names, weights=weights, k=num_requests):
+            started = time.perf_counter()
+            status = self.scenario(name, session, username, rng)
+            samples.append((name, time.perf_counter() - started, status))
+        if record:
+            with self._lock:
+                for name, elapsed, status in samples:
+                    self._samples[name].append((elapsed, status))
+
+    def run(self, total_requests, warmup=0):
+        if warmup:
+            self._execute(warmup, record=False)
+        self._samples.clear()
+        started = time.perf_counter()
+        self._execute(total_requests, record=True)
+        elapsed = time.perf_counter() - started
+        return self.summarize(elapsed)
+
+    def _execute(self, total_requests, record):
+        per_worker = [total_requests // self.concurrency] * self.concurrency
+        for i in range(total_requests % self.concurrency):
+            per_worker[i] += 1
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._worker, i, n, record) for i, n in enumerate(per_worker)]
+            for future in futures:
+                future.result()
+
+    def summarize(self, elapsed):
+        routes = {}
+        for name, samples in sorted(self._samples.items()):
+            latencies = sorted(s[0] for s in samples)
+            routes[name] = {
+                'requests': len(samples),
+                'errors': sum(1 for s in samples if s[1] >= 500),
+                'limited': sum(1 for s in samples if s[1] == 429),
+                'throughput': len(samples) / elapsed,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'max_ms': latencies[-1] * 1000,
+            }
+        total = sum(r['requests'] for r in routes.values())
+        return {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'mode': 'server' if self.session_class is HttpSession else 'test_client',
+                'concurrency': self.concurrency,
+                'mix': self.mix,
+                'seed': self.seed,
+                'elapsed_seconds': elapsed,
+                'total_requests': total,
+                'throughput': total / elapsed,
+                'database': app.config['SQLALCHEMY_DATABASE_URI'],
+                'ingest_mode': app.config['ORDER_INGEST_MODE'],
+                'rate_limit': rate_limiter.enabled,
+            },
+            'routes': routes,
+        }
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """返回退化项列表：p95 延迟上升或吞吐量下降超过 threshold（比例）"""
+    regressions = []
+    for name, base in baseline['routes'].items():
+        current = results['routes'].get(name)
+        if current is None:
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if current['throughput'] < base['throughput'] * (1 - threshold):
+            regressions.append(f"{name}: 吞吐量 {base['throughput']:.1f}/s -> {current['throughput']:.1f}/s")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{name}: 5xx 错误 {base['errors']} -> {current['errors']}")
+    return regressions
+
+
+def print_report(results):
+    meta = results['meta']
+    print(f"模式 {meta['mode']}，并发 {meta['concurrency']}，共 {meta['total_requests']} 个请求，"
+          f"用时 {meta['elapsed_seconds']:.2f} 秒，总吞吐 {meta['throughput']:.1f} 请求/秒")
+    print(f"{'路由':<10}{'请求数':>8}{'错误':>6}{'限流':>6}{'吞吐/s':>10}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}")
+    for name, r in results['routes'].items():
+        print(f"{name:<10}{r['requests']:>8}{r['errors']:>6}{r.get('limited', 0):>6}{r['throughput']:>10.1f}"
+              f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}")
+
+
+def parse_mix(value):
+    """解析 'dishes=50,orders=30' 形式的行为比例"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'未知的压测场景: {name}')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTTP 级压测与性能回归基准')
+    parser.add_argument('--requests', type=int, default=2000, help='计入统计的请求总数')
+    parser.add_argument('--warmup', type=int, default=200, help='预热请求数（不计入统计）')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=20, help='压测用户数')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='例如 dishes=50,orders=30,order=15,login=5')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--server', action='store_true', help='经由本地 WSGI 服务器发送真实 HTTP 请求')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='保留下单和登录的准入限流（默认关闭，测量应用本身的处理能力）')
+    parser.add_argument('-o', '--output', help='结果 JSON 文件')
+    parser.add_argument('--baseline', help='与该基线 JSON 比较，退化时以状态 1 退出')
+    parser.add_argument('--save-baseline', help='将本次结果保存为基线')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的退化比例，默认 0.2（20%%）')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    # 压测直接提交表单，不走页面上的 CSRF 令牌
+    app.config['WTF_CSRF_ENABLED'] = False
+    # 少量压测用户高频下单和登录，默认关闭限流，否则测到的是 429 的处理速度
+    rate_limiter.enabled = args.rate_limit
+    usernames, dish_ids = ensure_bench_data(args.users)
+
+    server = None
+    session_class, base_url = TestClientSession, None
+    if args.server:
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        session_class, base_url = HttpSession, f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        bench = Benchmark(usernames, dish_ids, mix=args.mix, concurrency=args.concurrency, seed=args.seed,
+                          session_class=session_class, base_url=base_url)
+        results = bench.run(args.requests, warmup=args.warmup)
+    finally:
+        if server is not None:
+            server.shutdown()
+        order_queue.stop()  # 提交批处理队列中剩余的压测订单
+
+    print_report(results)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"性能退化超过 {args.threshold:.0%}：")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"与基线相比未发现超过 {args.threshold:.0%} 的退化")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+"""两级缓存：进程内 LRU（L1）+ Redis（L2）
+
+VersionedCache 的所有键都带有一个保存在 Redis 中的版本号，写操作只需
+递增版本号即可让所有进程的旧条目同时失效，无需逐个删除。
+
+对 Redis 的调用都经过 CircuitBreaker：连续失败或超时达到阈值后断路器打开，
+此后的调用立即抛出 CircuitOpenError（RedisError 的子类），缓存退化为只用 L1，
+请求线程不会再阻塞在连接超时上；冷却时间过后放行一次试探调用，成功即恢复。
+未配置 Redis 时断路器始终打开，L1 单独工作（开发和测试环境）。
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.rediscache import RedisCache
+from redis.exceptions import RedisError
+
+_MISSING = object()
+
+
+class LRUCache:
+    """线程安全、容量有界、带过期时间的进程内缓存"""
+
+    def __init__(self, maxsize=512, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CircuitOpenError(RedisError):
+    """断路器打开（或未配置 Redis），调用未发往 Redis"""
+
+
+class CircuitBreaker:
+    """连续 failure_threshold 次失败后打开，reset_timeout 秒后半开试探
+
+    耗时超过 slow_call 秒的调用即使成功也计为一次失败，Redis 变慢时同样熔断。
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=10.0, slow_call=0.25):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # 只放行一次试探，结果出来前其余调用仍被拒绝
+                self.state = self.HALF_OPEN
+                self._opened_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info(f"{self.name} 断路器恢复")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"{self.name} 断路器打开，{self.reset_timeout} 秒内只使用本地缓存")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 断路器已打开")
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except RedisError:
+            self.record_failure()
+            raise
+        if time.monotonic() - started > self.slow_call:
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+
+class GuardedRedis:
+    """让 Redis 客户端的每次网络调用都经过断路器；client 为 None 时所有调用直接失败"""
+
+    def __init__(self, client, breaker):
+        self.client = client
+        self.breaker = breaker
+
+    def __getattr__(self, name):
+        if self.client is None:
+            def unavailable(*args, **kwargs):
+                raise CircuitOpenError("未配置 Redis")
+            return unavailable
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def guarded(*args, **kwargs):
+            return self.breaker.call(attr, *args, **kwargs)
+        return guarded
+
+    def pipeline(self, *args, **kwargs):
+        if self.client is None:
+            raise CircuitOpenError("未配置 Redis")
+        return _GuardedPipeline(self.client.pipeline(*args, **kwargs), self.breaker)
+
+
+class _GuardedPipeline:
+    """管道只在 execute 时访问网络"""
+
+    def __init__(self, pipeline, breaker):
+        self._pipeline = pipeline
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+    def execute(self, *args, **kwargs):
+        return self._breaker.call(self._pipeline.execute, *args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._pipeline.reset()
+
+
+class TieredCache(BaseCache):
+    """Flask-Caching 后端：进程内 LRU 在前，Redis（可选）在后
+
+    配置 CACHE_TYPE = 'cache_tiers.TieredCache'，CACHE_REDIS_HOST 传入已包装断路器的
+    GuardedRedis 实例（为 None 时只用 L1）。L1 条目的存活时间不超过 CACHE_L1_TTL，
+    其他进程删除或覆盖的条目最多在这段时间内仍可能被本进程读到；删除必须立即在
+    所有进程生效的条目（如登录身份）读写时传 shared_only=True，只使用 Redis。
+    L1 直接保存对象本身，调用方不应修改从缓存取出的值。
+    """
+
+    def __init__(self, redis=None, maxsize=1024, l1_ttl=30, default_timeout=300, key_prefix=''):
+        super().__init__(default_timeout=default_timeout)
+        self.local = LRUCache(maxsize=maxsize, ttl=l1_ttl)
+        self.l1_ttl = l1_ttl
+        self.remote = None
+        if redis is not None:
+            self.remote = RedisCache(host=redis, default_timeout=default_timeout, key_prefix=key_prefix)
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        return cls(
+            redis=config.get('CACHE_REDIS_HOST'),
+            maxsize=config.get('CACHE_L1_MAXSIZE', 1024),
+            l1_ttl=config.get('CACHE_L1_TTL', 30),
+            key_prefix=config.get('CACHE_KEY_PREFIX') or '',
+            **kwargs
+        )
+
+    def _local_ttl(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return self.l1_ttl if timeout == 0 else min(timeout, self.l1_ttl)
+
+    def _remote(self, method, *args):
+        """调用 L2，Redis 不可用时返回 None"""
+        if self.remote is None:
+            return None
+        try:
+            return getattr(self.remote, method)(*args)
+        except CircuitOpenError:
+            return None
+        except RedisError as e:
+            logging.warning(f"Redis 缓存 {method} 失败: {e}")
+            return None
+
+    def _skip_local(self, shared_only):
+        # 没有 Redis 时只有本进程的 L1，删除即时生效，仍然使用 L1
+        return shared_only and self.remote is not None
+
+    def get(self, key, shared_only=False):
+        if not self._skip_local(shared_only):
+            value = self.local.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        value = self._remote('get', key)
+        if value is not None and not self._skip_local(shared_only):
+            self.local.set(key, value)
+        return value
+
+    def has(self, key):
+        return self.local.get(key, _MISSING) is not _MISSING or bool(self._remote('has', key))
+
+    def set(self, key, value, timeout=None, shared_only=False):
+        if not self._skip_local(shared_only):
+            self.local.set(key, value, ttl=self._local_ttl(timeout))
+        self._remote('set', key, value, timeout)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self._remote('delete', key)
+        return True
+
+    def clear(self):
+        self.local.clear()
+        self._remote('clear')
+        return True
+
+
+class VersionedCache:
+    """以 Redis 中的版本号为键前缀的两级缓存
+
+    值以 JSON 写入 Redis，因此 loader 必须返回可 JSON 序列化的数据。
+    on_lookup(result) 在每次读取后以 'l1_hit' / 'l2_hit' / 'miss' 回调，用于统计命中率。
+    Redis 不可用时沿用最近一次读到的版本号，只用 L1 继续服务。
+    """
+
+    def __init__(self, redis_client, namespace, maxsize=512, ttl=300, on_lookup=None):
+        self.redis = redis_client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.on_lookup = on_lookup or (lambda result: None)
+        self._version = 0  # 最近一次从 Redis 读到的版本号（或本地递增后的版本号）
+
+    @property
+    def version_key(self):
+        return f'{self.namespace}:version'
+
+    def version(self):
+        try:
+            self._version = int(self.redis.get(self.version_key) or 0)
+        except CircuitOpenError:
+            pass
+        except RedisError as e:
+            logging.warning(f"读取缓存版本号失败，使用本地版本号: {e}")
+        return self._version
+
+    def bump(self):
+        """递增版本号，所有进程中旧版本的条目随即失效"""
+        try:
+            self._version = self.redis.incr(self.version_key)
+        except RedisError as e:
+            # 无法通知其他进程时至少清空本进程，其余进程的条目在 ttl 内过期
+            if not isinstance(e, CircuitOpenError):
+                logging.error(f"递增缓存版本号失败: {e}")
+            self.local.clear()
+            self._version += 1
+        return self._version
+
+    def get(self, name, loader):
+        key = f'{self.namespace}:v{self.version()}:{name}'
+
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self.on_lookup('l1_hit')
+            return value
+
+        try:
+            raw = self.redis.get(key)
+        except RedisError:
+            raw = None
+        if raw is not None:
+            value = json.loads(raw)
+            self.local.set(key, value)
+            self.on_lookup('l2_hit')
+            return value
+
+        value = loader()
+        self.on_lookup('miss')
+        self.local.set(key, value)
+        try:
+            self.redis.set(key, json.dumps(value, ensure_ascii=False), ex=self.ttl)
+        except CircuitOpenError:
+            pass
+        except RedisError as e:
+            logging.warning(f"写入缓存失败: {e}")
+        return value
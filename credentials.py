@@ -0,0 +1,108 @@
+"""口令哈希：在有界进程池中计算，并限制同时进行的登录数
+
+scrypt / pbkdf2 是刻意设计的 CPU 密集运算，在请求线程中计算会长时间占用 GIL，
+登录高峰时拖慢同一进程中的下单请求。CredentialHasher 把哈希和校验交给
+max_workers 个子进程，同时用信号量限制并发数：超过 max_concurrent 的请求最多等待
+acquire_timeout 秒，仍拿不到名额时抛出 LoginBusyError，由调用方返回 503。
+
+哈希参数（method，如 'scrypt:32768:8:1' 或 'pbkdf2:sha256:600000'）可配置；
+校验成功后若存储的哈希使用的是旧参数，verify() 会顺带返回按新参数重新计算的哈希。
+max_workers 为 0 时在调用线程中直接计算（开发和测试环境）。
+
+子进程由 forkserver（不支持时为 spawn）创建，而不是从已有请求线程、后台线程的
+Web 进程直接 fork，不会继承其他线程持有的锁，进程池何时创建都是安全的。
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class LoginBusyError(Exception):
+    """同时进行的登录/注册过多，请稍后重试"""
+
+
+def _hash_params(password_hash):
+    return password_hash.split('$', 1)[0]
+
+
+class CredentialHasher:
+    def __init__(self, method='scrypt', max_workers=2, max_concurrent=4, acquire_timeout=2.0):
+        self.method = method
+        self.max_workers = max_workers
+        self.max_concurrent = max_concurrent
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()  # 计数由多个请求线程同时更新
+        self.in_flight = 0
+        self.rejected = 0
+        self.rehashed = 0
+        # 'scrypt' 这类简写会被展开为带参数的完整前缀，计算一次作为比较基准
+        self.params = _hash_params(generate_password_hash('', method))
+
+    def start(self):
+        """预先创建进程池，避免第一个登录请求等待子进程启动"""
+        if self.max_workers > 0:
+            self._executor().submit(int).result()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context(method))
+            return self._pool
+
+    def _run(self, func, *args):
+        if self.max_workers <= 0:
+            return func(*args)
+        try:
+            return self._executor().submit(func, *args).result()
+        except BrokenProcessPool as e:
+            # 子进程异常退出（如被 OOM 杀掉）时重建进程池，本次在当前线程计算
+            logging.error(f"口令哈希进程池已损坏，重新创建: {e}")
+            with self._pool_lock:
+                self._pool = None
+            return func(*args)
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._stats_lock:
+                self.rejected += 1
+            raise LoginBusyError('同时登录的用户过多')
+        with self._stats_lock:
+            self.in_flight += 1
+
+    def _release(self):
+        with self._stats_lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def needs_rehash(self, password_hash):
+        return _hash_params(password_hash) != self.params
+
+    def hash(self, password):
+        self._acquire()
+        try:
+            return self._run(generate_password_hash, password, self.method)
+        finally:
+            self._release()
+
+    def verify(self, password_hash, password):
+        """返回 (是否匹配, 新哈希或 None)；只有匹配且参数已变化时才返回新哈希"""
+        self._acquire()
+        try:
+            if not self._run(check_password_hash, password_hash, password):
+                return False, None
+            if not self.needs_rehash(password_hash):
+                return True, None
+            with self._stats_lock:
+                self.rehashed += 1
+            return True, self._run(generate_password_hash, password, self.method)
+        finally:
+            self._release()
@@ -0,0 +1,238 @@
+"""合成数据生成器：批量生成用户、餐厅、菜品、订单和订单明细
+
+用法：
+    python datagen.py --orders 1000000 --users 50000 --restaurants 2000 --seed 42
+    python datagen.py --orders 200000 --end 2024-06-30 --days 90
+
+全部通过 SQLAlchemy Core 的 executemany 按块写入，主键按当前最大ID预先分配，
+订单与明细在内存中直接关联，不经过 ORM 对象，也不需要回读自增ID。
+随机数整块生成（random.choices 的 cum_weights 形式），分布接近真实业务：
+- 餐厅和用户的下单量服从 Zipf 分布，少数热门餐厅和活跃用户占大部分订单；
+- 下单时间集中在午餐（11-13 点）和晚餐（17-20 点）两个高峰；
+- 最近一小时内的订单处于待处理/准备中，更早的订单大多已完成，少量取消。
+订单和明细表的二级索引在写入期间删除、结束后重建（--keep-indexes 可关闭）。
+相同的 --seed 与 --end 生成完全相同的数据。生成结束后会写入销售汇总表增量、
+重建全文检索索引和后厨看板，并使菜单缓存失效。
+"""
+import argparse
+import itertools
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from redis.exceptions import RedisError
+from werkzeug.security import generate_password_hash
+
+from app import (app, db, User, Restaurant, Dish, Order, OrderDetail, OrderStatus, SalesDelta,
+                 catalog_cache, order_shards, rebuild_search_index, kitchen_board, rebuild_kitchen_board)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 20000
+# 每小时的下单权重（0-23 点），午餐和晚餐两个高峰
+HOUR_WEIGHTS = [1, 1, 0.5, 0.3, 0.3, 0.5, 1, 3, 5, 4, 6, 14, 16, 10, 5, 4, 5, 12, 15, 13, 8, 5, 3, 2]
+# 每单菜品数 1-5 和每道菜数量 1-3 的权重
+LINES_WEIGHTS = [40, 30, 15, 10, 5]
+QUANTITY_WEIGHTS = [70, 22, 8]
+CANCEL_RATE = 0.06
+
+
+def zipf_cum_weights(n, s, rng):
+    """n 个元素的 Zipf 累积权重，热门元素随机分布在各个ID上"""
+    weights = [1.0 / (rank + 1) ** s for rank in range(n)]
+    rng.shuffle(weights)
+    return list(itertools.accumulate(weights))
+
+
+def next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+@contextmanager
+def deferred_indexes(*models):
+    """批量写入期间删除二级索引，结束后一次性重建（比逐行维护索引快得多）"""
+    indexes = [index for model in models for index in model.__table__.indexes if not index.unique]
+    connection = db.session.connection()
+    for index in indexes:
+        index.drop(connection, checkfirst=True)
+    db.session.commit()
+    try:
+        yield
+    finally:
+        db.session.rollback()
+        connection = db.session.connection()
+        for index in indexes:
+            index.create(connection, checkfirst=True)
+        db.session.commit()
+
+
+class DataGenerator:
+    def __init__(self, seed=0, end=None, days=30, chunk_size=CHUNK_SIZE):
+        self.rng = random.Random(seed)
+        self.end = end or datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        self.days = days
+        self.chunk_size = chunk_size
+        self.inserted = defaultdict(int)
+        self.delta = SalesDelta()
+
+    def insert(self, model, rows):
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
+            self.inserted[model.__tablename__] += len(rows)
+
+    def generate_users(self, count):
+        """所有用户共用同一个密码哈希（user123），避免逐个计算哈希"""
+        start = next_id(User)
+        password = generate_password_hash('user123')
+        for offset in range(0, count, self.chunk_size):
+            self.insert(User, [
+                {'id': i, 'username': f'user_{i}', 'password': password, 'phone': f'138{i:08d}'[-11:],
+                 'address': f'测试路 {i % 999 + 1} 号', 'is_admin': False}
+                for i in range(start + offset, start + min(count, offset + self.chunk_size))
+            ])
+        db.session.commit()
+        return list(range(start, start + count))
+
+    def generate_restaurants(self, count, dishes_per_restaurant):
+        """返回 (餐厅ID列表, {餐厅ID: [(菜品ID, 单价分), ...]})"""
+        rng = self.rng
+        restaurant_start, dish_start = next_id(Restaurant), next_id(Dish)
+        restaurant_ids = list(range(restaurant_start, restaurant_start + count))
+        self.insert(Restaurant, [
+            {'id': r, 'name': f'餐厅 {r}', 'address': f'美食街 {r} 号', 'phone': f'021{r:08d}'[-11:],
+             'description': f'第 {r} 家测试餐厅'}
+            for r in restaurant_ids
+        ])
+        menus, dish_rows = {}, []
+        dish_id = dish_start
+        for r in restaurant_ids:
+            n = rng.randint(max(1, dishes_per_restaurant // 2), dishes_per_restaurant * 3 // 2)
+            prices = [rng.randrange(800, 12800, 50) for _ in range(n)]
+            menus[r] = [(dish_id + i, price) for i, price in enumerate(prices)]
+            dish_rows.extend(
+                {'id': dish_id + i, 'name': f'菜品 {dish_id + i}', 'description': f'餐厅 {r} 的招牌菜',
+                 'price': price / 100, 'restaurant_id': r, 'is_available': True}
+                for i, price in enumerate(prices)
+            )
+            dish_id += n
+        for offset in range(0, len(dish_rows), self.chunk_size):
+            self.insert(Dish, dish_rows[offset:offset + self.chunk_size])
+        db.session.commit()
+        return restaurant_ids, menus
+
+    def generate_orders(self, count, user_ids, restaurant_ids, menus):
+        rng = self.rng
+        user_weights = zipf_cum_weights(len(user_ids), 0.8, rng)
+        restaurant_weights = zipf_cum_weights(len(restaurant_ids), 1.1, rng)
+        hour_weights = list(itertools.accumulate(HOUR_WEIGHTS))
+        lines_weights = list(itertools.accumulate(LINES_WEIGHTS))
+        quantity_weights = list(itertools.accumulate(QUANTITY_WEIGHTS))
+        first_day = self.end - timedelta(days=self.days)
+        recent = self.end - timedelta(hours=1)
+
+        order_id, detail_id = next_id(Order), next_id(OrderDetail)
+        for offset in range(0, count, self.chunk_size):
+            n = min(self.chunk_size, count - offset)
+            users = rng.choices(user_ids, cum_weights=user_weights, k=n)
+            restaurants = rng.choices(restaurant_ids, cum_weights=restaurant_weights, k=n)
+            day_offsets = [rng.randrange(self.days) for _ in range(n)]
+            hours = rng.choices(range(24), cum_weights=hour_weights, k=n)
+            seconds = [rng.randrange(3600) for _ in range(n)]
+            line_counts = rng.choices(range(1, 6), cum_weights=lines_weights, k=n)
+            quantities = iter(rng.choices(range(1, 4), cum_weights=quantity_weights, k=sum(line_counts)))
+            status_rolls = [rng.random() for _ in range(n)]
+
+            orders, details = [], []
+            for i in range(n):
+                order_time = first_day + timedelta(days=day_offsets[i], hours=hours[i], seconds=seconds[i])
+                if order_time >= recent:
+                    status = OrderStatus.PENDING if status_rolls[i] < 0.5 else OrderStatus.PROCESSING
+                else:
+                    status = OrderStatus.CANCELLED if status_rolls[i] < CANCEL_RATE else OrderStatus.COMPLETED
+
+                menu = menus[restaurants[i]]
+                total = 0
+                lines = []
+                for dish, price in rng.sample(menu, min(line_counts[i], len(menu))):
+                    quantity = next(quantities)
+                    subtotal = price * quantity
+                    total += subtotal
+                    lines.append((dish, quantity, Decimal(subtotal).scaleb(-2)))
+                    details.append({'id': detail_id, 'order_id': order_id, 'dish_id': dish,
+                                    'quantity': quantity, 'unit_price': Decimal(price).scaleb(-2),
+                                    'subtotal': Decimal(subtotal).scaleb(-2)})
+                    detail_id += 1
+                total_amount = Decimal(total).scaleb(-2)
+                orders.append({'id': order_id, 'user_id': users[i], 'restaurant_id': restaurants[i],
+                               'order_time': order_time, 'status': status, 'total_amount': total_amount,
+                               'delivery_address': f'测试路 {users[i] % 999 + 1} 号', 'note': None,
+                               'ingest_key': None})
+                order_id += 1
+
+                # 汇总表口径与 save_order_payloads 一致：取消的订单只计入状态计数
+                self.delta.move_status(None, status)
+                if status != OrderStatus.CANCELLED:
+                    self.delta.add_order(restaurants[i], order_time, total_amount, lines)
+
+            self.insert(Order, orders)
+            self.insert(OrderDetail, details)
+            db.session.commit()
+            logger.info(f"已生成 {offset + n} / {count} 个订单")
+
+    def finalize(self):
+        """维护派生数据：销售汇总表、全文检索索引、后厨看板和菜单缓存"""
+        self.delta.apply()
+        db.session.commit()
+        rebuild_search_index()
+        # Core 批量写入不经过提交事件，看板需按订单表重建
+        if kitchen_board.available:
+            try:
+                logger.info(f"后厨看板上共有 {rebuild_kitchen_board()} 个订单")
+            except RedisError as e:
+                logger.error(f"重建后厨看板失败，看板将在首次读取时重建: {e}")
+        catalog_cache.bump()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量生成合成订单数据')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--restaurants', type=int, default=500)
+    parser.add_argument('--dishes-per-restaurant', type=int, default=20, help='每家餐厅的平均菜品数')
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=30, help='订单时间分布在截止日期前的天数')
+    parser.add_argument('--end', type=lambda s: datetime.strptime(s, '%Y-%m-%d'),
+                        help='截止日期 YYYY-MM-DD，默认今天零点（UTC）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--keep-indexes', action='store_true', help='写入期间保留订单表和明细表的二级索引')
+    args = parser.parse_args(argv)
+    if order_shards.enabled:
+        # 订单ID按主库自增预先分配，也不会按餐厅拆分到各分片
+        parser.error('暂不支持订单分片：请在未设置 ORDER_SHARD_URLS 时生成数据')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    with app.app_context():
+        db.create_all()
+        generator = DataGenerator(seed=args.seed, end=args.end, days=args.days, chunk_size=args.chunk_size)
+        started = time.perf_counter()
+        user_ids = generator.generate_users(args.users)
+        restaurant_ids, menus = generator.generate_restaurants(args.restaurants, args.dishes_per_restaurant)
+        with nullcontext() if args.keep_indexes else deferred_indexes(Order, OrderDetail):
+            generator.generate_orders(args.orders, user_ids, restaurant_ids, menus)
+        elapsed = time.perf_counter() - started
+        generator.finalize()
+
+    total = sum(generator.inserted.values())
+    for table, rows in generator.inserted.items():
+        print(f"{table}: {rows} 行")
+    print(f"共 {total} 行，用时 {elapsed:.2f} 秒，{total / elapsed:.0f} 行/秒")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
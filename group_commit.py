@@ -0,0 +1,223 @@
+"""组提交（group commit）队列
+
+写入方把订单放入队列后立即返回，后台线程按以下规则合并提交：
+- 队列中积累的数量达到当前批大小时立即提交；
+- 最早入队的条目等待超过 max_latency 秒时，无论批是否凑满都提交；
+- 批大小根据到达速率和提交耗时自适应调整，在 [min_batch, max_batch] 之间；
+- 队列深度达到 max_depth 时 put() 最多阻塞 put_timeout 秒，仍无空间则抛出 QueueFullError；
+- 整批提交失败时逐条重试，失败的条目放回队首，累计失败 max_attempts 次后
+  交给 dead_letter 回调并丢弃，单个坏条目不会阻塞后续条目。
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+
+class QueueFullError(Exception):
+    """队列已满，写入方应拒绝或稍后重试"""
+
+
+class GroupCommitQueue:
+    def __init__(self, flush, initial_batch=10, min_batch=1, max_batch=500,
+                 max_latency=0.2, max_depth=5000, put_timeout=0.5, smoothing=0.3,
+                 max_attempts=5, dead_letter=None):
+        """dead_letter(item, error) 接收重试 max_attempts 次仍失败的条目，为 None 时只记录日志"""
+        self._flush = flush
+        self._dead_letter = dead_letter
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_depth = max_depth
+        self.put_timeout = put_timeout
+        self.smoothing = smoothing
+        self.max_attempts = max_attempts
+
+        self._items = deque()  # (入队时间, 条目, 已失败次数)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._failures = 0
+
+        self.batch_size = initial_batch
+        self.arrival_rate = 0.0  # 条/秒，指数平滑
+        self.avg_flush_seconds = 0.0
+        self.last_flush_seconds = 0.0
+        self.flushes = 0
+        self.flushed_items = 0
+        self.rejected = 0
+        self.dead_lettered = 0
+        self._arrivals = 0
+        self._rate_window_start = time.monotonic()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """入队；队列过深时施加背压"""
+        self.start()
+        with self._cond:
+            if len(self._items) >= self.max_depth:
+                deadline = time.monotonic() + self.put_timeout
+                while len(self._items) >= self.max_depth:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise QueueFullError(f"订单队列已满（{len(self._items)}）")
+                    self._cond.wait(remaining)
+            self._items.append((time.monotonic(), item, 0))
+            self._arrivals += 1
+            # 队列由空变为非空时唤醒后台线程开始计算 max_latency，凑满一批时唤醒立即提交
+            if len(self._items) == 1 or len(self._items) >= self.batch_size:
+                self._cond.notify_all()
+
+    def start(self):
+        """启动后台提交线程（重复调用无副作用）"""
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """停止后台线程，退出前提交队列中剩余的条目"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def flush_now(self):
+        """在调用线程中同步提交队列中的全部条目，返回提交数量"""
+        total = 0
+        while True:
+            with self._cond:
+                batch = self._pop(self.max_batch)
+            if not batch:
+                return total
+            total += len(batch) - self._process(batch)
+
+    def stats(self):
+        return {
+            'depth': len(self._items),
+            'batch_size': self.batch_size,
+            'arrival_rate': self.arrival_rate,
+            'last_flush_seconds': self.last_flush_seconds,
+            'avg_flush_seconds': self.avg_flush_seconds,
+            'flushes': self.flushes,
+            'flushed_items': self.flushed_items,
+            'rejected': self.rejected,
+            'dead_lettered': self.dead_lettered,
+        }
+
+    def _pop(self, n):
+        batch = [self._items.popleft() for _ in range(min(n, len(self._items)))]
+        if batch:
+            self._cond.notify_all()  # 唤醒因背压等待的写入方
+        return batch
+
+    def _next_batch(self):
+        """等待直到批凑满、最早条目到期或队列停止"""
+        with self._cond:
+            while True:
+                if self._items:
+                    if len(self._items) >= self.batch_size or self._stopping:
+                        return self._pop(self.batch_size)
+                    wait = self._items[0][0] + self.max_latency - time.monotonic()
+                    if wait <= 0:
+                        return self._pop(self.batch_size)
+                    self._cond.wait(wait)
+                elif self._stopping:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            failed = self._process(batch)
+            if not failed:
+                self._failures = 0
+                continue
+            # 按连续失败次数退避后重试放回队首的条目
+            self._failures += 1
+            logging.error(f"{len(batch)} 条中有 {failed} 条提交失败（连续第 {self._failures} 次）")
+            time.sleep(min(0.1 * 2 ** self._failures, 5.0))
+
+    def _process(self, batch):
+        """提交一批条目，返回提交失败的条目数
+
+        整批失败时逐条提交以定位坏条目；失败的条目放回队首等待重试，
+        累计失败 max_attempts 次后移交 dead_letter。
+        """
+        try:
+            self._commit([item for _, item, _ in batch])
+            return 0
+        except Exception as e:
+            batch_error = e
+        if len(batch) == 1:
+            failed = [(batch[0], batch_error)]
+        else:
+            logging.warning(f"批量提交 {len(batch)} 条失败，改为逐条提交: {batch_error}")
+            failed = []
+            for entry in batch:
+                try:
+                    self._commit([entry[1]])
+                except Exception as e:
+                    failed.append((entry, e))
+
+        retry = []
+        for (enqueued, item, attempts), error in failed:
+            if attempts + 1 >= self.max_attempts:
+                self._give_up(item, error)
+            else:
+                retry.append((enqueued, item, attempts + 1))
+        if retry:
+            with self._cond:
+                self._items.extendleft(reversed(retry))
+        return len(failed)
+
+    def _give_up(self, item, error):
+        self.dead_lettered += 1
+        logging.error(f"条目提交 {self.max_attempts} 次均失败，移入死信: {error}")
+        if self._dead_letter is None:
+            return
+        try:
+            self._dead_letter(item, error)
+        except Exception as e:
+            logging.error(f"死信处理失败，条目已丢弃: {e}; 条目: {item!r}")
+
+    def _commit(self, batch):
+        started = time.monotonic()
+        self._flush(batch)
+        elapsed = time.monotonic() - started
+        self.last_flush_seconds = elapsed
+        self.avg_flush_seconds += self.smoothing * (elapsed - self.avg_flush_seconds)
+        self.flushes += 1
+        self.flushed_items += len(batch)
+        self._adapt(len(batch), elapsed)
+
+    def _adapt(self, committed, elapsed):
+        """按到达速率调整批大小
+
+        一次提交期间到达的条目都要等下一批，所以理想批大小约为
+        到达速率 × (提交耗时 + 允许的等待时间)；提交后仍有积压时翻倍追赶。
+        """
+        now = time.monotonic()
+        window = now - self._rate_window_start
+        if window > 0:
+            rate = self._arrivals / window
+            self.arrival_rate += self.smoothing * (rate - self.arrival_rate)
+        self._arrivals = 0
+        self._rate_window_start = now
+
+        target = self.arrival_rate * (elapsed + self.max_latency)
+        if len(self._items) > self.batch_size:
+            target = max(target, self.batch_size * 2)
+        target = round(self.batch_size + self.smoothing * (target - self.batch_size))
+        self.batch_size = max(self.min_batch, min(self.max_batch, target))
@@ -0,0 +1,170 @@
+"""后厨看板：每家餐厅待处理/准备中的订单保存在 Redis 有序集合中
+
+每家餐厅两个有序集合（kitchen:{餐厅ID}:pending / :processing），成员为订单ID，
+分数为下单时间戳；订单摘要（版本号、下单时间、金额）另存一个哈希。看板读取为
+ZRANGE + HMGET，O(log n + m)，不访问数据库。
+
+订单事件在事务提交后应用，同一批事件在一个 Lua 脚本中原子执行。各进程提交的
+事件到达 Redis 的顺序不一定与提交顺序一致，因此每个订单记录已应用的版本号，
+只接受更高版本的事件；订单离开看板后留下一个带过期时间的版本墓碑，迟到的旧事件
+不会把它重新加回。启动时从数据库重建，重建写入同样经过版本检查。
+
+重建完成后写入标记键 {prefix}:built。标记缺失（从未重建、Redis 被清空）时
+read() 返回 None，由调用方重建或改为查询数据库，不会把空看板当作没有订单。
+"""
+import json
+import logging
+
+from redis.exceptions import NoScriptError, RedisError
+
+from cache_tiers import CircuitOpenError
+
+# KEYS 每个订单 5 个：pending、processing、摘要哈希、版本哈希、墓碑
+# ARGV[1] 为墓碑过期秒数，之后每个订单 5 个：订单ID、版本号、分数、状态（pending/processing/空）、摘要
+_APPLY_SCRIPT = """
+local ttl = tonumber(ARGV[1])
+local applied = 0
+for i = 1, #KEYS / 5 do
+    local k = (i - 1) * 5
+    local a = (i - 1) * 5 + 1
+    local order_id, version = ARGV[a + 1], tonumber(ARGV[a + 2])
+    local seen = redis.call('HGET', KEYS[k + 4], order_id) or redis.call('GET', KEYS[k + 5]) or '0'
+    if version > tonumber(seen) then
+        redis.call('ZREM', KEYS[k + 1], order_id)
+        redis.call('ZREM', KEYS[k + 2], order_id)
+        local state = ARGV[a + 4]
+        if state == 'pending' or state == 'processing' then
+            local board = state == 'pending' and KEYS[k + 1] or KEYS[k + 2]
+            redis.call('ZADD', board, ARGV[a + 3], order_id)
+            redis.call('HSET', KEYS[k + 3], order_id, ARGV[a + 5])
+            redis.call('HSET', KEYS[k + 4], order_id, version)
+        else
+            redis.call('HDEL', KEYS[k + 3], order_id)
+            redis.call('HDEL', KEYS[k + 4], order_id)
+            redis.call('SET', KEYS[k + 5], version, 'EX', ttl)
+        end
+        applied = applied + 1
+    end
+end
+return applied
+"""
+
+
+class KitchenBoard:
+    def __init__(self, redis, prefix='kitchen', tombstone_ttl=3600, chunk_size=500):
+        """redis 为 None 时 available 为 False，由调用方改为查询数据库"""
+        self.redis = redis
+        self.prefix = prefix
+        self.tombstone_ttl = tombstone_ttl
+        self.chunk_size = chunk_size
+        self._sha = None
+        self.errors = 0
+
+    @property
+    def available(self):
+        return self.redis is not None
+
+    @property
+    def built_key(self):
+        return f'{self.prefix}:built'
+
+    @property
+    def lock_key(self):
+        return f'{self.prefix}:rebuilding'
+
+    def acquire_rebuild_lock(self, timeout=300):
+        """多个进程同时发现看板缺失时只有一个重建；timeout 秒后锁自动释放，防止重建进程崩溃后无法重试"""
+        return bool(self.redis.set(self.lock_key, 1, nx=True, ex=timeout))
+
+    def release_rebuild_lock(self):
+        self.redis.delete(self.lock_key)
+
+    def _keys(self, restaurant_id, order_id):
+        base = f'{self.prefix}:{restaurant_id}'
+        return [f'{base}:pending', f'{base}:processing', f'{base}:orders', f'{base}:versions',
+                f'{self.prefix}:done:{order_id}']
+
+    def _run_script(self, keys, args):
+        # 脚本只在首次使用和 Redis 重启后上传，之后按 SHA 调用
+        if self._sha is None:
+            self._sha = self.redis.script_load(_APPLY_SCRIPT)
+        try:
+            return self.redis.evalsha(self._sha, len(keys), *keys, *args)
+        except NoScriptError:
+            self._sha = self.redis.script_load(_APPLY_SCRIPT)
+            return self.redis.evalsha(self._sha, len(keys), *keys, *args)
+
+    def apply(self, entries):
+        """entries 为字典：order_id、restaurant_id、version、state（'pending'/'processing'，
+        其他值表示离开看板）、order_time（datetime）、total_amount；返回实际应用的条数"""
+        entries = list(entries)
+        applied = 0
+        for offset in range(0, len(entries), self.chunk_size):
+            keys, args = [], [self.tombstone_ttl]
+            for entry in entries[offset:offset + self.chunk_size]:
+                keys.extend(self._keys(entry['restaurant_id'], entry['order_id']))
+                summary = json.dumps({'version': entry['version'], 'order_time': entry['order_time'].isoformat(),
+                                      'total_amount': str(entry['total_amount'])})
+                args.extend([entry['order_id'], entry['version'], entry['order_time'].timestamp(),
+                             entry['state'] or '', summary])
+            applied += self._run_script(keys, args)
+        return applied
+
+    def sync(self, entries):
+        """提交后同步订单变化；Redis 不可用时只记录，看板在下次重建前可能滞后"""
+        if not self.available:
+            return 0
+        try:
+            return self.apply(entries)
+        except RedisError as e:
+            self.errors += 1
+            if not isinstance(e, CircuitOpenError):
+                logging.error(f"更新后厨看板失败: {e}")
+            return 0
+
+    def clear(self):
+        """删除所有看板数据（墓碑保留，避免重建期间迟到的旧事件生效）"""
+        batch = []
+        for key in self.redis.scan_iter(match=f'{self.prefix}:*', count=1000):
+            key_name = key.decode()
+            if not key_name.startswith(f'{self.prefix}:done:') and key_name != self.lock_key:
+                batch.append(key)
+            if len(batch) >= self.chunk_size:
+                self.redis.delete(*batch)
+                batch = []
+        if batch:
+            self.redis.delete(*batch)
+
+    def rebuild(self, entries):
+        """清空后按数据库中的活动订单重建，返回写入的订单数"""
+        self.clear()
+        applied = self.apply(entries)
+        self.redis.set(self.built_key, applied)
+        return applied
+
+    def read(self, restaurant_id, limit=100):
+        """返回 {'pending': [...], 'processing': [...], 'counts': {...}}，每组按下单时间升序，最多 limit 个；
+        看板尚未重建时返回 None"""
+        base = f'{self.prefix}:{restaurant_id}'
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.exists(self.built_key)
+        for state in ('pending', 'processing'):
+            pipe.zrange(f'{base}:{state}', 0, limit - 1)
+            pipe.zcard(f'{base}:{state}')
+        built, pending, pending_count, processing, processing_count = pipe.execute()
+        if not built:
+            return None
+        ids = [int(member) for member in pending + processing]
+        summaries = self.redis.hmget(f'{base}:orders', ids) if ids else []
+        orders = {}
+        for order_id, summary in zip(ids, summaries):
+            if summary is None:
+                # 摘要与有序集合在同一脚本中维护，缺失只可能是键被手工删除
+                logging.warning(f"看板订单 {order_id} 缺少摘要")
+                continue
+            orders[order_id] = {'id': order_id, **json.loads(summary)}
+        return {
+            'pending': [orders[int(m)] for m in pending if int(m) in orders],
+            'processing': [orders[int(m)] for m in processing if int(m) in orders],
+            'counts': {'pending': pending_count, 'processing': processing_count},
+        }
@@ -0,0 +1,137 @@
+"""订单事件推送：Redis 发布/订阅 + 进程内扇出
+
+下单和状态转换提交后，写入方把订单事件（created / transitioned）发布到一个
+Redis 频道。每个 Web 进程只用一个后台线程订阅该频道，再按用户或餐厅过滤后
+分发给本进程内的 SSE 连接，浏览器不必反复刷新订单列表。
+
+每个连接有一个有界队列，消费过慢导致队列写满时断开该连接，浏览器的
+EventSource 会自动重连并重新加载页面状态。未配置 Redis 或发布失败时只分发给
+本进程内的订阅者（单进程开发环境足够）。
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+from cache_tiers import CircuitOpenError
+
+
+class EventBusFullError(Exception):
+    """本进程的事件订阅连接数已达上限"""
+
+
+class Subscription:
+    def __init__(self, bus, user_id=None, restaurant_id=None, maxsize=100):
+        self.bus = bus
+        self.user_id = user_id
+        self.restaurant_id = restaurant_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def matches(self, event):
+        return ((self.user_id is None or event['user_id'] == self.user_id) and
+                (self.restaurant_id is None or event['restaurant_id'] == self.restaurant_id))
+
+    def events(self, heartbeat):
+        """逐个返回事件；heartbeat 秒内没有事件时返回 None（供调用方发送心跳），连接被断开时结束"""
+        while not self.closed:
+            try:
+                event = self.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield None
+                continue
+            yield event
+
+    def close(self):
+        self.bus._unsubscribe(self)
+
+
+class OrderEventBus:
+    def __init__(self, publisher=None, subscriber=None, channel='orders:events',
+                 queue_size=100, max_subscribers=500, reconnect_delay=1.0):
+        """publisher 用于发布（可经过断路器），subscriber 为不带读超时的连接，用于后台订阅"""
+        self.publisher = publisher
+        self.subscriber = subscriber
+        self.channel = channel
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.reconnect_delay = reconnect_delay
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._listener = None
+        self.published = 0
+        self.dropped = 0
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+    def publish(self, events):
+        """发布一批事件，Redis 不可用时只分发给本进程的订阅者"""
+        events = list(events)
+        if not events:
+            return
+        self.published += len(events)
+        if self.publisher is not None:
+            try:
+                pipe = self.publisher.pipeline(transaction=False)
+                for event in events:
+                    pipe.publish(self.channel, json.dumps(event, ensure_ascii=False))
+                pipe.execute()
+                return
+            except RedisError as e:
+                if not isinstance(e, CircuitOpenError):
+                    logging.warning(f"发布订单事件失败，只推送给本进程的连接: {e}")
+        for event in events:
+            self._dispatch(event)
+
+    def subscribe(self, user_id=None, restaurant_id=None):
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                raise EventBusFullError('订单事件连接数已达上限')
+            subscription = Subscription(self, user_id, restaurant_id, self.queue_size)
+            self._subscriptions.add(subscription)
+            if self.subscriber is not None and self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='order-events', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        subscription.closed = True
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _dispatch(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if not subscription.matches(event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                # 消费过慢的连接直接断开，避免事件在内存中无限堆积
+                self.dropped += 1
+                self._unsubscribe(subscription)
+
+    def _listen(self):
+        while True:
+            pubsub = self.subscriber.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None or message['type'] != 'message':
+                        continue
+                    try:
+                        self._dispatch(json.loads(message['data']))
+                    except ValueError as e:
+                        logging.error(f"无法解析订单事件，已忽略: {e}")
+            except RedisError as e:
+                logging.error(f"订阅订单事件失败，{self.reconnect_delay} 秒后重连: {e}")
+                time.sleep(self.reconnect_delay)
+            finally:
+                pubsub.close()
@@ -0,0 +1,111 @@
+"""订单分片：按餐厅ID把订单写入多个数据库（通常是多个 SQLite 文件）
+
+单个 SQLite 文件同一时刻只允许一个写事务，所有餐厅的下单都在排同一把锁。
+配置 ORDER_SHARD_URLS 后，订单、明细、归档和销售汇总表在每个分片上各有一份，
+餐厅 r 的订单写入分片 r % N，不同分片的写事务互不阻塞；用户、餐厅和菜品等
+目录数据仍在主库。
+
+分片通过 Flask-SQLAlchemy 的 binds 配置（order_shard_0 ... order_shard_{N-1}），
+由 ShardRoutingSession.get_bind 按语句涉及的表选择连接：订单相关的表路由到
+当前分片（use() / each() 设置），其余表使用主库。一条语句同时涉及两边的表、
+或者查询订单表前没有选择分片都会直接报错，不会悄悄读到主库中的空表。
+
+分片 k 只分配 ID % N == k 的订单ID，按订单ID即可找到所在分片，ID 全局唯一。
+分片数确定后不能修改（没有重新分片的工具）。
+"""
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.util import find_tables
+
+_current_shard = contextvars.ContextVar('order_shard', default=None)
+
+
+class ShardRoutingError(RuntimeError):
+    """语句无法路由到唯一的数据库"""
+
+
+class OrderShards:
+    def __init__(self, count=0, tables=()):
+        """count 为 0 时不分片，use() / each() 仍可调用，语句全部使用主库"""
+        self.enabled = count > 0
+        self.count = max(count, 1)
+        self.tables = frozenset(tables)
+
+    @property
+    def bind_keys(self):
+        return [self.bind_key(shard) for shard in range(self.count)] if self.enabled else []
+
+    @staticmethod
+    def bind_key(shard):
+        return f'order_shard_{shard}'
+
+    @property
+    def current(self):
+        return _current_shard.get()
+
+    def shard_for_restaurant(self, restaurant_id):
+        return restaurant_id % self.count
+
+    def shard_for_order(self, order_id):
+        return order_id % self.count
+
+    @contextmanager
+    def use(self, shard):
+        """在 with 块内把订单相关的表路由到指定分片"""
+        token = _current_shard.set(shard)
+        try:
+            yield shard
+        finally:
+            _current_shard.reset(token)
+
+    def each(self):
+        """依次切换到每个分片（未分片时只有一个），循环体内的订单查询路由到当前分片"""
+        for shard in range(self.count):
+            with self.use(shard):
+                yield shard
+
+    def partition(self, order_ids):
+        """按订单ID所在的分片分组，返回 {分片: [订单ID, ...]}"""
+        groups = defaultdict(list)
+        for order_id in order_ids:
+            groups[self.shard_for_order(order_id)].append(order_id)
+        return dict(groups)
+
+    def route(self, mapper=None, clause=None):
+        """语句涉及订单相关的表时返回当前分片的 bind key，否则返回 None（使用主库）"""
+        if not self.enabled:
+            return None
+        tables = set()
+        if mapper is not None:
+            tables.add(sa.inspect(mapper).local_table.name)
+        if clause is not None:
+            tables.update(t.name for t in find_tables(clause, include_crud=True))
+        sharded = tables & self.tables
+        if not sharded:
+            return None
+        if tables - self.tables:
+            raise ShardRoutingError(
+                f"分片模式下不能在一条语句中同时访问订单表和主库表: {sorted(tables)}")
+        shard = self.current
+        if shard is None:
+            raise ShardRoutingError(f"访问 {sorted(sharded)} 前需要先选择订单分片")
+        return self.bind_key(shard)
+
+
+class ShardRoutingSession(Session):
+    """db.session 的会话类：订单相关的表路由到当前分片，其余沿用 binds 的默认规则"""
+
+    def __init__(self, db, shards=None, **kwargs):
+        super().__init__(db, **kwargs)
+        self._shards = shards or OrderShards()
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            key = self._shards.route(mapper, clause)
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,170 @@
+"""订单写入进程：从 Redis Stream 消费订单并批量提交到数据库
+
+用法：
+    ORDER_INGEST_MODE=stream python app.py          # Web 进程只负责写入 Stream
+    python order_writer.py --consumer writer-1      # 启动一个或多个写入进程
+
+同一消费组内的多个写入进程自动分摊消息，吞吐随实例数扩展。
+消息只有在数据库提交成功后才会被确认（XACK），进程崩溃时未确认的消息
+会在 --claim-idle 毫秒后被其他实例通过 XAUTOCLAIM 接管并重新投递；
+订单的 ingest_key 保证重投递不会产生重复订单。
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import time
+
+from redis.exceptions import RedisError, ResponseError
+
+from app import (app, db, redis_client, save_order_payloads,
+                 ORDER_STREAM_KEY, ORDER_STREAM_GROUP, ORDER_DEAD_LETTER_KEY)
+
+logger = logging.getLogger(__name__)
+
+
+class OrderStreamWriter:
+    def __init__(self, consumer, batch_size=100, block_ms=1000,
+                 claim_idle_ms=30000, claim_interval=5.0, max_deliveries=5):
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_interval = claim_interval
+        self.max_deliveries = max_deliveries
+        self._last_claim = 0.0
+
+    def ensure_group(self):
+        """创建消费组（已存在时忽略）"""
+        try:
+            redis_client.xgroup_create(ORDER_STREAM_KEY, ORDER_STREAM_GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read_own_pending(self):
+        """分批产出本消费者重启前已领取但未确认的消息，直到 PEL 读完
+
+        从上一批最后一个ID之后继续读取，本轮仍未能写入的消息不会被重复读到
+        """
+        last_id = '0'
+        while True:
+            resp = redis_client.xreadgroup(ORDER_STREAM_GROUP, self.consumer,
+                                           {ORDER_STREAM_KEY: last_id}, count=self.batch_size)
+            messages = resp[0][1] if resp else []
+            if not messages:
+                return
+            yield messages
+            last_id = messages[-1][0]
+
+    def claim_stale(self):
+        """接管其他实例长时间未确认的消息（实例崩溃后的重投递）"""
+        now = time.time()
+        if now - self._last_claim < self.claim_interval:
+            return []
+        self._last_claim = now
+        resp = redis_client.xautoclaim(ORDER_STREAM_KEY, ORDER_STREAM_GROUP, self.consumer,
+                                       min_idle_time=self.claim_idle_ms, start_id='0-0',
+                                       count=self.batch_size)
+        return resp[1]
+
+    def read_new(self):
+        resp = redis_client.xreadgroup(ORDER_STREAM_GROUP, self.consumer,
+                                       {ORDER_STREAM_KEY: '>'}, count=self.batch_size,
+                                       block=self.block_ms)
+        return resp[0][1] if resp else []
+
+    def ack(self, message_ids):
+        """确认并删除已落库的消息，Stream 中只保留未处理的订单"""
+        if not message_ids:
+            return
+        pipe = redis_client.pipeline()
+        pipe.xack(ORDER_STREAM_KEY, ORDER_STREAM_GROUP, *message_ids)
+        pipe.xdel(ORDER_STREAM_KEY, *message_ids)
+        pipe.execute()
+
+    def dead_letter(self, message_id, fields, reason):
+        """将无法处理的消息移入死信 Stream，避免反复阻塞消费"""
+        redis_client.xadd(ORDER_DEAD_LETTER_KEY, {**fields, 'reason': reason,
+                                                 'source_id': message_id})
+        self.ack([message_id])
+        logger.error(f"订单消息 {message_id} 已移入死信队列: {reason}")
+
+    def delivery_count(self, message_id):
+        entries = redis_client.xpending_range(ORDER_STREAM_KEY, ORDER_STREAM_GROUP,
+                                              min=message_id, max=message_id, count=1)
+        return entries[0]['times_delivered'] if entries else 0
+
+    def process(self, messages):
+        """批量落库；整批失败时逐条重试，定位并隔离坏消息"""
+        parsed = []
+        for message_id, fields in messages:
+            try:
+                parsed.append((message_id, fields, json.loads(fields[b'payload'])))
+            except (KeyError, ValueError) as e:
+                self.dead_letter(message_id, fields, f"无法解析: {e}")
+        if not parsed:
+            return 0
+
+        with app.app_context():
+            try:
+                save_order_payloads([payload for _, _, payload in parsed])
+                self.ack([message_id for message_id, _, _ in parsed])
+                return len(parsed)
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"批量写入 {len(parsed)} 个订单失败，改为逐条写入: {e}")
+
+            saved = 0
+            for message_id, fields, payload in parsed:
+                try:
+                    save_order_payloads([payload])
+                    self.ack([message_id])
+                    saved += 1
+                except Exception as e:
+                    db.session.rollback()
+                    # 未确认的消息留在 PEL 中，等待 XAUTOCLAIM 重投递
+                    if self.delivery_count(message_id) >= self.max_deliveries:
+                        self.dead_letter(message_id, fields, str(e))
+                    else:
+                        logger.error(f"订单消息 {message_id} 写入失败，等待重投递: {e}")
+            return saved
+
+    def run(self):
+        self.ensure_group()
+        logger.info(f"订单写入进程 {self.consumer} 已启动")
+        for messages in self.read_own_pending():
+            saved = self.process(messages)
+            logger.info(f"{self.consumer} 恢复未确认的订单 {saved}/{len(messages)} 个")
+        messages = []
+        while True:
+            try:
+                if messages:
+                    saved = self.process(messages)
+                    logger.info(f"{self.consumer} 写入 {saved}/{len(messages)} 个订单")
+                messages = self.claim_stale() or self.read_new()
+            except RedisError as e:
+                logger.error(f"Redis 连接异常，稍后重试: {e}")
+                messages = []
+                time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='从 Redis Stream 消费订单并写入数据库')
+    parser.add_argument('--consumer', default=f"{socket.gethostname()}-{os.getpid()}",
+                        help='消费者名称，同名实例重启后会先处理自己未确认的消息')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--block-ms', type=int, default=1000)
+    parser.add_argument('--claim-idle', type=int, default=30000,
+                        help='消息未确认超过该毫秒数后由其他实例接管')
+    parser.add_argument('--max-deliveries', type=int, default=5)
+    args = parser.parse_args()
+
+    writer = OrderStreamWriter(args.consumer, batch_size=args.batch_size, block_ms=args.block_ms,
+                               claim_idle_ms=args.claim_idle, max_deliveries=args.max_deliveries)
+    writer.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,20 @@
 import time
 import psutil
 import os
-from app import app, db, Order, User, Restaurant, Dish, OrderDetail, OrderStatus
+from app import (app, db, Order, User, Restaurant, Dish, OrderDetail, OrderStatus, order_list_page, encode_order_cursor,
+                 OrderConflictError, SalesDelta, RestaurantDailySales, OrderStatusCount, DishSales,
+                 compute_sales_aggregates, stored_sales_aggregates, sales_aggregate_drift,
+                 RATE_LIMITS, rate_limiter)
+from rate_limit import Limit
+from group_commit import GroupCommitQueue
+from flask import render_template
+from flask_login import login_user
+from sqlalchemy import event
 from memory_profiler import profile
 import statistics
 from concurrent.futures import ThreadPoolExecutor
 import random
+import threading
 from decimal import Decimal
 import logging
 from datetime import datetime, timedelta
@@ -186,6 +195,163 @@ class PerformanceTest:
         
         return count1, count2
 
+    def test_orders_page_queries(self, user_id):
+        """测试订单列表页的 SQL 数量与每页订单数和翻页深度无关"""
+        logger.info("开始测试订单列表查询次数...")
+        
+        statements = []
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        user = db.session.get(User, user_id)
+        oldest = Order.query.filter_by(user_id=user_id)\
+            .order_by(Order.order_time.asc(), Order.id.asc()).offset(20).first()
+        cursors = {
+            '第一页': None,
+            '第二页': order_list_page(user).next_cursor,
+            '最后一页': encode_order_cursor(oldest),
+        }
+        
+        query_counts = {}
+        event.listen(db.engine, 'before_cursor_execute', record_statement)
+        try:
+            for name, cursor in cursors.items():
+                with self.app.test_request_context('/orders'):
+                    login_user(user)
+                    statements.clear()
+                    orders = order_list_page(user, after=cursor)
+                    render_template('orders.html', orders=orders)
+                    query_counts[name] = len(statements)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record_statement)
+        
+        # 订单 + 明细，不再有 COUNT(*)，也不随翻页深度变化
+        assert set(query_counts.values()) == {2}, query_counts
+        return query_counts
+
+    def test_transition_contention(self, user_id, restaurant_id, num_orders=50, contenders=8):
+        """多个线程同时转换同一批订单：每个订单恰好一个线程成功，其余得到冲突，汇总表不漂移"""
+        logger.info("开始测试订单状态转换并发冲突...")
+        
+        # 测试数据直接写入订单表，先按订单数据重建汇总表，再把新订单计入汇总
+        RestaurantDailySales.query.delete()
+        OrderStatusCount.query.delete()
+        DishSales.query.delete()
+        compute_sales_aggregates().apply()
+        orders = [Order(user_id=user_id, restaurant_id=restaurant_id, order_time=datetime.utcnow(),
+                        total_amount=Decimal('10.00'), status=OrderStatus.PENDING)
+                  for _ in range(num_orders)]
+        db.session.add_all(orders)
+        delta = SalesDelta()
+        for order in orders:
+            delta.move_status(None, order.status)
+            delta.add_order(restaurant_id, order.order_time, order.total_amount, [])
+        delta.apply()
+        db.session.commit()
+        # 所有线程都按创建后看到的版本号提交，模拟多人基于同一页面同时操作
+        seen_versions = {order.id: order.version for order in orders}
+        order_ids = list(seen_versions)
+        
+        def contend(order_id, new_status):
+            with app.app_context():
+                order = db.session.get(Order, order_id)
+                try:
+                    order.transition_to(new_status, expected_version=seen_versions[order_id])
+                    db.session.commit()
+                    return order_id, 'won'
+                except OrderConflictError:
+                    db.session.rollback()
+                    return order_id, 'conflict'
+                except ValueError:
+                    # 读取时其他线程已提交，状态机直接拒绝
+                    db.session.rollback()
+                    return order_id, 'stale'
+        
+        targets = [OrderStatus.PROCESSING, OrderStatus.CANCELLED]
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=contenders) as executor:
+            futures = [executor.submit(contend, order_id, targets[i % len(targets)])
+                       for order_id in order_ids for i in range(contenders)]
+            results = [f.result() for f in futures]
+        elapsed = time.time() - start_time
+        
+        winners = {order_id: 0 for order_id in order_ids}
+        for order_id, outcome in results:
+            winners[order_id] += outcome == 'won'
+        assert set(winners.values()) == {1}, winners
+        drift = sales_aggregate_drift(compute_sales_aggregates(), stored_sales_aggregates())
+        assert not drift, drift
+        
+        conflicts = sum(outcome == 'conflict' for _, outcome in results)
+        return len(results) / elapsed, conflicts
+
+    def test_admission_control(self, user_id, dish_id, burst=20):
+        """同一用户突发下单：超出桶容量的请求直接返回 429 和 Retry-After，且比正常下单快"""
+        logger.info("开始测试下单准入控制...")
+        
+        # 测试期间几乎不补充令牌；限额名带时间戳，不受 Redis 中上次运行留下的桶影响
+        saved = dict(RATE_LIMITS), rate_limiter.enabled, self.app.config.get('WTF_CSRF_ENABLED', True)
+        RATE_LIMITS['order_user'] = Limit(f'perf_order_user_{time.time_ns()}', 0.001, burst)
+        RATE_LIMITS['order_global'] = Limit('order_global', 0, 0)
+        rate_limiter.enabled = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        latencies = {302: [], 429: []}
+        try:
+            client = self.app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user_id)
+                session['_fresh'] = True
+            for _ in range(burst * 2):
+                start_time = time.perf_counter()
+                response = client.post('/order', data={'dish_id': dish_id, 'quantity': 1, 'note': ''})
+                latencies.setdefault(response.status_code, []).append(time.perf_counter() - start_time)
+                if response.status_code == 429:
+                    assert int(response.headers['Retry-After']) >= 1
+        finally:
+            RATE_LIMITS.update(saved[0])
+            rate_limiter.enabled, self.app.config['WTF_CSRF_ENABLED'] = saved[1], saved[2]
+        
+        assert len(latencies[302]) == burst and len(latencies[429]) == burst, \
+            {code: len(values) for code, values in latencies.items()}
+        admitted_ms = statistics.median(latencies[302]) * 1000
+        rejected_ms = statistics.median(latencies[429]) * 1000
+        assert rejected_ms < admitted_ms, (admitted_ms, rejected_ms)
+        return admitted_ms, rejected_ms
+
+    def test_group_commit(self, max_latency=0.2):
+        """空闲后入队的单个条目无需凑满批大小即被提交；坏条目移入死信，不阻塞同批的其他条目"""
+        logger.info("开始测试组提交队列...")
+        
+        committed, dead = [], []
+        flushed = threading.Event()
+        
+        def flush(batch):
+            if 'bad' in batch:
+                raise ValueError('坏条目')
+            committed.extend(batch)
+            flushed.set()
+        
+        queue = GroupCommitQueue(flush, initial_batch=10, max_latency=max_latency, max_attempts=2,
+                                 dead_letter=lambda item, error: dead.append(item))
+        try:
+            queue.start()
+            time.sleep(max_latency)  # 后台线程已在空队列上等待
+            start_time = time.perf_counter()
+            queue.put('single')
+            # 不再入队其他条目：只要单独提交了这一条，就说明没有等待凑满批大小；
+            # 超时留足余量，只用于判定卡住，不测量精确延迟
+            assert flushed.wait(max_latency * 5), '单个条目一直等待凑满批大小，未被提交'
+            single_latency = time.perf_counter() - start_time
+            assert committed == ['single'], committed
+            
+            for item in ['a', 'b', 'bad', 'c']:
+                queue.put(item)
+        finally:
+            queue.stop()
+        assert committed == ['single', 'a', 'b', 'c'] and dead == ['bad'], (committed, dead)
+        assert len(queue) == 0 and queue.dead_lettered == 1
+        return single_latency * 1000
+
     def run_all_tests(self):
         """运行所有性能测试"""
         logger.info("开始全面性能测试...")
@@ -209,6 +375,18 @@ class PerformanceTest:
             # 4. 测试内存使用
             total_count, page_count = self.test_memory_usage()
             
+            # 5. 测试订单列表查询次数
+            page_queries = self.test_orders_page_queries(user_id)
+            
+            # 6. 测试订单状态转换并发冲突
+            transition_rate, transition_conflicts = self.test_transition_contention(user_id, restaurant_id)
+            
+            # 7. 测试下单准入控制
+            admitted_ms, rejected_ms = self.test_admission_control(user_id, dish_ids[0])
+            
+            # 8. 测试组提交队列
+            single_commit_ms = self.test_group_commit()
+            
             # 输出测试结果
             logger.info("\n性能测试结果:")
             logger.info(f"1. 查询性能:")
@@ -230,6 +408,21 @@ class PerformanceTest:
             logger.info(f"   - 全量加载订单数: {total_count}")
             logger.info(f"   - 分页总订单数: {page_count}")
             
+            logger.info(f"\n5. 订单列表查询次数:")
+            for page, count in page_queries.items():
+                logger.info(f"   - {page}: {count} 条 SQL")
+            
+            logger.info(f"\n6. 状态转换并发冲突:")
+            logger.info(f"   - 每秒状态转换尝试数: {transition_rate:.2f}")
+            logger.info(f"   - 冲突次数: {transition_conflicts}")
+            
+            logger.info(f"\n7. 下单准入控制:")
+            logger.info(f"   - 放行请求耗时中位数: {admitted_ms:.2f}毫秒")
+            logger.info(f"   - 限流请求（429）耗时中位数: {rejected_ms:.2f}毫秒")
+            
+            logger.info(f"\n8. 组提交队列:")
+            logger.info(f"   - 空闲后单个订单的提交延迟: {single_commit_ms:.2f}毫秒")
+            
         except Exception as e:
             logger.error(f"性能测试过程中发生错误: {str(e)}")
             raise
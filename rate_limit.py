@@ -0,0 +1,139 @@
+"""准入控制：令牌桶限流，过载时在请求入口直接返回 429
+
+每个限额（Limit）是一组令牌桶：每秒补充 rate 个令牌，最多积攒 burst 个，
+每个请求消耗一个。一次请求同时检查多个桶（如"该用户"和"全站"），
+全部有令牌时才一起扣除，任一桶不足则都不扣除并返回需要等待的秒数。
+
+令牌桶保存在 Redis 哈希中，由一个 Lua 脚本原子地补充、检查和扣除，
+时间取 Redis 服务器的 TIME，各 Web 进程共享同一组桶且不受本机时钟偏差影响。
+Redis 不可用（或断路器打开）时改用进程内的令牌桶：限流依然生效，
+但全站限额变为每个进程各自计算。
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+
+from redis.exceptions import NoScriptError, RedisError
+
+from cache_tiers import CircuitOpenError
+
+# rate 为每秒补充的令牌数（0 表示不限制），burst 为桶容量（允许的突发请求数）
+Limit = namedtuple('Limit', 'name rate burst')
+
+# KEYS 为各桶的键；ARGV 每个桶 3 个：速率、容量、本次消耗
+# 返回 {0, ''} 表示已扣除；否则返回 {受限的桶序号（从 1 开始）, 需要等待的秒数}
+_ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local tokens = {}
+local blocked, wait = 0, 0
+for i = 1, #KEYS do
+    local a = (i - 1) * 3
+    local rate, burst, cost = tonumber(ARGV[a + 1]), tonumber(ARGV[a + 2]), tonumber(ARGV[a + 3])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local level = tonumber(bucket[1]) or burst
+    local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+    tokens[i] = math.min(burst, level + elapsed * rate)
+    if tokens[i] < cost and (cost - tokens[i]) / rate > wait then
+        blocked, wait = i, (cost - tokens[i]) / rate
+    end
+end
+if blocked > 0 then
+    return {blocked, tostring(wait)}
+end
+for i = 1, #KEYS do
+    local a = (i - 1) * 3
+    local rate, burst, cost = tonumber(ARGV[a + 1]), tonumber(ARGV[a + 2]), tonumber(ARGV[a + 3])
+    redis.call('HSET', KEYS[i], 'tokens', tokens[i] - cost, 'ts', now)
+    -- 桶补满之后的状态与不存在相同，到时即可删除
+    redis.call('PEXPIRE', KEYS[i], math.ceil(burst / rate * 1000) + 1000)
+end
+return {0, ''}
+"""
+
+
+class RateLimitExceeded(Exception):
+    """请求超出限额，retry_after 秒后重试"""
+
+    def __init__(self, limit, retry_after):
+        super().__init__(f"超出限额 {limit.name}，{retry_after:.2f} 秒后重试")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    def __init__(self, redis=None, prefix='ratelimit', local_maxsize=10000):
+        """redis 为 None 时只使用进程内的令牌桶"""
+        self.redis = redis
+        self.prefix = prefix
+        self.local_maxsize = local_maxsize
+        self.enabled = True
+        self._sha = None
+        self._local = OrderedDict()  # 键 -> [令牌数, 时间]，超出容量时淘汰最久未用的桶
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = defaultdict(int)  # 限额名 -> 拒绝次数
+        self.fallbacks = 0
+
+    def _run_script(self, keys, args):
+        if self._sha is None:
+            self._sha = self.redis.script_load(_ACQUIRE_SCRIPT)
+        try:
+            return self.redis.evalsha(self._sha, len(keys), *keys, *args)
+        except NoScriptError:
+            self._sha = self.redis.script_load(_ACQUIRE_SCRIPT)
+            return self.redis.evalsha(self._sha, len(keys), *keys, *args)
+
+    def _acquire_remote(self, buckets, cost):
+        keys = [f'{self.prefix}:{limit.name}:{key}' for limit, key in buckets]
+        args = [value for limit, _ in buckets for value in (limit.rate, limit.burst, cost)]
+        blocked, wait = self._run_script(keys, args)
+        return (buckets[blocked - 1][0], float(wait)) if blocked else (None, 0.0)
+
+    def _acquire_local(self, buckets, cost):
+        now = time.monotonic()
+        with self._lock:
+            levels, blocked, wait = [], None, 0.0
+            for limit, key in buckets:
+                level, ts = self._local.get((limit.name, key), (limit.burst, now))
+                level = min(limit.burst, level + (now - ts) * limit.rate)
+                levels.append(level)
+                if level < cost and (cost - level) / limit.rate > wait:
+                    blocked, wait = limit, (cost - level) / limit.rate
+            if blocked is not None:
+                return blocked, wait
+            for (limit, key), level in zip(buckets, levels):
+                self._local[(limit.name, key)] = [level - cost, now]
+                self._local.move_to_end((limit.name, key))
+            while len(self._local) > self.local_maxsize:
+                self._local.popitem(last=False)
+        return None, 0.0
+
+    def acquire(self, buckets, cost=1):
+        """buckets 为 [(Limit, 键), ...]；全部有令牌时各扣除 cost，
+        否则都不扣除并抛出 RateLimitExceeded（retry_after 为受限最久的桶需要等待的秒数）"""
+        buckets = [(limit, key) for limit, key in buckets if limit.rate > 0]
+        if not self.enabled or not buckets:
+            return
+        result = None
+        if self.redis is not None:
+            try:
+                result = self._acquire_remote(buckets, cost)
+            except RedisError as e:
+                self.fallbacks += 1
+                if not isinstance(e, CircuitOpenError):
+                    logging.warning(f"令牌桶限流访问 Redis 失败，改用进程内限流: {e}")
+        if result is None:
+            result = self._acquire_local(buckets, cost)
+        blocked, wait = result
+        if blocked is not None:
+            self.rejected[blocked.name] += 1
+            raise RateLimitExceeded(blocked, wait)
+        self.admitted += 1
+
+    @staticmethod
+    def retry_after_header(retry_after):
+        """Retry-After 只能是整数秒，向上取整且至少为 1"""
+        return str(max(1, math.ceil(retry_after)))
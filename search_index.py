@@ -0,0 +1,124 @@
+"""菜品与餐厅全文检索（SQLite FTS5）
+
+FTS5 自带的 unicode61 分词器不会切分连续的中文，因此写入前先自行分词：
+中文按单字 + 相邻二元组（n-gram）切分，英文和数字按单词切分，再以空格
+拼接后交给 FTS5 建立倒排索引。查询时中文只用二元组（单字查询用单字），
+最后一个英文单词做前缀匹配，结果按 bm25 排序（名称权重高于描述）。
+
+非 SQLite 数据库或未编译 FTS5 时 available 为 False，由调用方降级为 LIKE 查询。
+"""
+import logging
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+_CJK = '㐀-䶿一-鿿豈-﫿'
+_TOKEN_RE = re.compile(f'[{_CJK}]+|[^\\W_{_CJK}]+')
+_CJK_RE = re.compile(f'[{_CJK}]')
+
+# 两类文档共用一张表，rowid = 实体ID * 2 + 类型偏移，更新和删除都按 rowid 定位
+KIND_OFFSETS = {'dish': 0, 'restaurant': 1}
+
+
+def tokenize(value, for_query=False):
+    tokens = []
+    for run in _TOKEN_RE.findall((value or '').lower()):
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+            continue
+        bigrams = [run[i:i + 2] for i in range(len(run) - 1)]
+        if for_query:
+            tokens.extend(bigrams or [run])
+        else:
+            tokens.extend(run)
+            tokens.extend(bigrams)
+    return tokens
+
+
+def build_match_query(query):
+    """把用户输入转换为 FTS5 MATCH 表达式，无可检索内容时返回 None"""
+    tokens = tokenize(query, for_query=True)
+    if not tokens:
+        return None
+    terms = ['"' + t.replace('"', '""') + '"' for t in tokens]
+    if not _CJK_RE.match(tokens[-1]):
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class SearchIndex:
+    def __init__(self, table='search_index'):
+        self.table = table
+        self.available = None  # None 表示尚未检测
+
+    def ensure(self, connection):
+        """按需创建 FTS5 虚拟表，返回当前数据库是否支持全文检索"""
+        if self.available is not None:
+            return self.available
+        if connection.dialect.name != 'sqlite':
+            self.available = False
+            return False
+        try:
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                f"kind UNINDEXED, ref_id UNINDEXED, name, description, tokenize='unicode61')"
+            ))
+            self.available = True
+        except OperationalError as e:
+            logging.warning(f"SQLite 不支持 FTS5，搜索将降级为 LIKE 查询: {e}")
+            self.available = False
+        return self.available
+
+    def _insert(self, connection, documents):
+        rows = [
+            {'rowid': ref_id * 2 + KIND_OFFSETS[kind], 'kind': kind, 'ref_id': ref_id,
+             'name': ' '.join(tokenize(name)), 'description': ' '.join(tokenize(description))}
+            for kind, ref_id, name, description in documents
+        ]
+        if rows:
+            connection.execute(
+                text(f"INSERT INTO {self.table} (rowid, kind, ref_id, name, description) "
+                     f"VALUES (:rowid, :kind, :ref_id, :name, :description)"),
+                rows
+            )
+        return len(rows)
+
+    def upsert(self, connection, kind, ref_id, name, description):
+        if not self.ensure(connection):
+            return
+        connection.execute(text(f"DELETE FROM {self.table} WHERE rowid = :rowid"),
+                           {'rowid': ref_id * 2 + KIND_OFFSETS[kind]})
+        self._insert(connection, [(kind, ref_id, name, description)])
+
+    def remove(self, connection, kind, ref_id):
+        if not self.ensure(connection):
+            return
+        connection.execute(text(f"DELETE FROM {self.table} WHERE rowid = :rowid"),
+                           {'rowid': ref_id * 2 + KIND_OFFSETS[kind]})
+
+    def rebuild(self, connection, documents):
+        """清空并重建索引，documents 为 (类型, 实体ID, 名称, 描述) 的可迭代对象"""
+        if not self.ensure(connection):
+            return 0
+        connection.execute(text(f"DELETE FROM {self.table}"))
+        return self._insert(connection, documents)
+
+    def search(self, connection, query, kind=None, limit=20, offset=0):
+        """返回 (命中总数, [(类型, 实体ID), ...])，按相关度排序"""
+        match = build_match_query(query)
+        if match is None or not self.ensure(connection):
+            return 0, []
+        where = f"{self.table} MATCH :match"
+        params = {'match': match, 'limit': limit, 'offset': offset}
+        if kind is not None:
+            where += " AND kind = :kind"
+            params['kind'] = kind
+        total = connection.execute(
+            text(f"SELECT count(*) FROM {self.table} WHERE {where}"), params
+        ).scalar()
+        rows = connection.execute(text(
+            f"SELECT kind, ref_id FROM {self.table} WHERE {where} "
+            f"ORDER BY bm25({self.table}, 0.0, 0.0, 10.0, 1.0) LIMIT :limit OFFSET :offset"
+        ), params).all()
+        return total, [(row.kind, row.ref_id) for row in rows]
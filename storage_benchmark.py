@@ -0,0 +1,193 @@
+"""存储配置对比基准：比较各存储配置下的并发下单吞吐量
+
+用法：
+    python storage_benchmark.py                                   # SQLite 默认设置 vs 调优设置
+    python storage_benchmark.py --postgres-url postgresql://bench@localhost/bench_orders
+    python storage_benchmark.py --writers 16 --orders 4000 -o storage.json
+    python storage_benchmark.py --shards 2 4 8 --processes        # 多进程写入，比较按餐厅分片的扩展性
+
+每个配置在独立子进程中运行（存储配置在导入 app 时读取环境变量），
+SQLite 使用临时目录中的新数据库；PostgreSQL 请指向专用的空数据库。
+写入线程各自逐单调用 save_order_payloads 提交（与批处理队列的单条提交路径相同），
+读取线程同时翻阅订单列表，统计订单吞吐量、提交延迟和 database is locked 错误数。
+每个写入线程为一家餐厅下单，分片配置下各线程的订单按餐厅分散到各个分片。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def write_orders(user_id, dish_row, count):
+    """逐单调用 save_order_payloads 提交 count 个订单，返回 (提交延迟列表, 错误列表)"""
+    from app import app, db, User, build_order_payload, save_order_payloads
+
+    latencies, errors = [], []
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        for _ in range(count):
+            payload = build_order_payload(user, [(dish_row, 1)])
+            started = time.perf_counter()
+            try:
+                save_order_payloads([payload])
+            except Exception as e:
+                db.session.rollback()
+                errors.append(str(e).splitlines()[0])
+                continue
+            latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+def _write_orders_in_process(task):
+    # fork 出的进程不能使用父进程连接池中的连接，丢弃后重新连接
+    from app import app, db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    return write_orders(*task)
+
+
+def run_profile(num_orders, writers, readers, processes=False):
+    """在当前进程的存储配置下运行并发写入，返回统计结果
+
+    processes 为 True 时写入方为独立进程：同一进程内的线程受 GIL 限制，
+    分片只有在多个进程（多核）同时写入时才能体现吞吐量的提升
+    """
+    # 存储配置在导入 app 时读取，因此只在子进程中导入
+    from app import (app, db, User, Restaurant, Dish, order_list_page, order_shards,
+                     create_order_shard_tables)
+    from benchmark import percentile
+
+    with app.app_context():
+        db.create_all()
+        create_order_shard_tables()
+        restaurants = [Restaurant(name=f'storage_bench_{i}') for i in range(writers)]
+        db.session.add_all(restaurants)
+        db.session.flush()
+        dishes = [Dish(name='storage_bench_dish', price=18.0, restaurant_id=r.id) for r in restaurants]
+        users = [User(username=f'storage_bench_{i}_{time.time_ns()}', password='-', address='压测地址')
+                 for i in range(writers)]
+        db.session.add_all(dishes)
+        db.session.add_all(users)
+        db.session.commit()
+        dish_rows = [{'id': d.id, 'price': d.price, 'restaurant_id': d.restaurant_id} for d in dishes]
+        user_ids = [u.id for u in users]
+
+    done = threading.Event()
+
+    def read(worker):
+        reads = 0
+        with app.app_context():
+            user = db.session.get(User, user_ids[worker % len(user_ids)])
+            while not done.is_set():
+                order_list_page(user)
+                db.session.rollback()  # 结束读事务，WAL 检查点不会被长期持有的快照阻塞
+                reads += 1
+        return reads
+
+    per_writer = [num_orders // writers + (1 if i < num_orders % writers else 0) for i in range(writers)]
+    tasks = [(user_ids[i], dish_rows[i], n) for i, n in enumerate(per_writer)]
+    # 进程池在读取线程启动之前创建，fork 时父进程中没有其他线程
+    pool = multiprocessing.get_context('fork').Pool(writers) if processes else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers + readers) as executor:
+        reader_futures = [executor.submit(read, i) for i in range(readers)]
+        if pool is not None:
+            with pool:
+                results = pool.map(_write_orders_in_process, tasks)
+        else:
+            results = list(executor.map(lambda task: write_orders(*task), tasks))
+        elapsed = time.perf_counter() - started
+        done.set()
+        reads = sum(f.result() for f in reader_futures)
+
+    latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+    errors = [error for _, worker_errors in results for error in worker_errors]
+    latencies.sort()
+    return {
+        'database': app.config['SQLALCHEMY_DATABASE_URI'],
+        'shards': order_shards.count if order_shards.enabled else 0,
+        'writer_processes': processes,
+        'pragmas': app.config['SQLITE_PRAGMAS'],
+        'orders': len(latencies),
+        'errors': len(errors),
+        'locked_errors': sum('database is locked' in e for e in errors),
+        'elapsed_seconds': elapsed,
+        'orders_per_second': len(latencies) / elapsed,
+        'reads_per_second': reads / elapsed,
+        'commit_p50_ms': percentile(latencies, 50) * 1000,
+        'commit_p95_ms': percentile(latencies, 95) * 1000,
+        'commit_p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def profiles(args, workdir):
+    """(名称, 环境变量) 列表"""
+    result = [
+        ('sqlite-default', {'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "default.db")}',
+                            'SQLITE_PROFILE': 'default'}),
+        ('sqlite-tuned', {'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "tuned.db")}',
+                          'SQLITE_PROFILE': 'tuned'}),
+    ]
+    for count in args.shards:
+        urls = [f'sqlite:///{os.path.join(workdir, f"shards{count}_{i}.db")}' for i in range(count)]
+        result.append((f'sqlite-shards-{count}', {
+            'DATABASE_URL': f'sqlite:///{os.path.join(workdir, f"shards{count}_main.db")}',
+            'SQLITE_PROFILE': 'tuned', 'ORDER_SHARD_URLS': ','.join(urls)}))
+    if args.postgres_url:
+        result.append(('postgresql', {'DATABASE_URL': args.postgres_url}))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='比较各存储配置下的并发下单吞吐量')
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=10)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--shards', type=int, nargs='*', default=[2, 4],
+                        help='同时测试按餐厅分片到这些数量的 SQLite 文件（调优设置）')
+    parser.add_argument('--processes', action='store_true',
+                        help='写入方使用独立进程而不是线程（多核机器上比较分片的扩展性）')
+    parser.add_argument('--postgres-url', help='同时测试 PostgreSQL（应为专用的空数据库）')
+    parser.add_argument('-o', '--output', help='结果 JSON 文件')
+    parser.add_argument('--run-profile', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_profile:
+        # 子进程：按环境变量中的存储配置运行一次，结果以 JSON 写到标准输出最后一行
+        print(json.dumps(run_profile(args.orders, args.writers, args.readers, args.processes), ensure_ascii=False))
+        return 0
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, env in profiles(args, workdir):
+            cmd = [sys.executable, os.path.abspath(__file__), '--run-profile', '--orders', str(args.orders),
+                   '--writers', str(args.writers), '--readers', str(args.readers)]
+            if args.processes:
+                cmd.append('--processes')
+            proc = subprocess.run(cmd, env={**os.environ, 'REDIS_URL': '', 'ORDER_SHARD_URLS': '', **env},
+                                  capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if proc.returncode != 0:
+                print(f"{name} 运行失败:\n{proc.stderr}", file=sys.stderr)
+                return 1
+            results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(f"{'配置':<16}{'订单/秒':>10}{'读取/秒':>10}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'错误':>6}{'锁冲突':>8}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['orders_per_second']:>10.1f}{r['reads_per_second']:>10.1f}"
+              f"{r['commit_p50_ms']:>9.2f}{r['commit_p95_ms']:>9.2f}{r['commit_p99_ms']:>9.2f}"
+              f"{r['errors']:>6}{r['locked_errors']:>8}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())